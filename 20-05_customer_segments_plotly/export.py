@@ -0,0 +1,76 @@
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import kaleido
+
+# nr. of figures rendered in parallel by the renderer
+EXPORT_WORKERS = 4
+
+
+def export_figures(
+    figures,
+    directory,
+    formats=("png",),
+    width=None,
+    height=None,
+    scale=1,
+    n_workers=EXPORT_WORKERS,
+):
+    """Write many figures as static images (png, svg, pdf, ...) in one go.
+
+    `figures` maps names to figures, the files are named
+    "<name>.<format>" with the name made file-safe, so repeated runs
+    write to the same paths. A single headless Chrome is started for all
+    figures and renders `n_workers` of them in parallel. On servers
+    without Chrome run `plotly_get_chrome` once.
+
+    Returns the paths of the written files in the order of the figures
+    and formats.
+    """
+    names = {name: file_name(name) for name in figures}
+    if len(set(names.values())) < len(names):
+        raise ValueError(
+            "Figure names must be unique after making them file-safe."
+        )
+
+    os.makedirs(directory, exist_ok=True)
+    opts = {"width": width, "height": height, "scale": scale}
+    opts = {key: value for key, value in opts.items() if value is not None}
+    specs = []
+    for name, fig in figures.items():
+        fig_dict = fig.to_dict() if hasattr(fig, "to_dict") else fig
+        for image_format in formats:
+            path = os.path.join(directory, f"{names[name]}.{image_format}")
+            specs.append({
+                "fig": fig_dict,
+                "path": path,
+                "opts": dict(opts, format=image_format),
+            })
+
+    run(render(specs, n_workers))
+    return [spec["path"] for spec in specs]
+
+
+async def render(specs, n_workers):
+    """Render all specs with one renderer and n_workers parallel tabs."""
+    async with kaleido.Kaleido(n=n_workers) as renderer:
+        await renderer.write_fig_from_object(specs)
+
+
+def run(coroutine):
+    """Run a coroutine, also from a notebook with a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def file_name(name):
+    """Make a figure name file-safe, e.g. ("RFM", "Feb 2020") -> RFM_Feb_2020."""
+    if isinstance(name, tuple):
+        name = "_".join(str(part) for part in name)
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_")
@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 
 from utils import rfm_color_map, cls_color_map, aff_color_map
@@ -16,65 +18,121 @@ cls_args = [cls_col, cls_title, cls_color_map]
 aff_args = [aff_col, aff_title, aff_color_map]
 
 
-def display_parcat(df, month_list, segment_col, title, color_map):
+def display_parcat(
+    df, month_list, segment_col, title, color_map, aggregate=True, show=True
+):
+    """Display the paths of the members through the segments over time.
+
+    `segment_col` can be a list of segment columns, the paths are colored by
+    the first one and every further one adds a dimension per month.
+    With `aggregate=True` every distinct path is passed once with its nr.
+    of members, so the figure size depends on the nr. of paths only.
+    """
     df_wide = create_wide_df(df, month_list, segment_col, color_map)
-    display_parcats_over_time(df_wide, month_list, title, color_map)
+    if aggregate:
+        df_wide = create_path_df(df_wide)
+    return display_parcats_over_time(df_wide, title, show)
 
 
 def create_wide_df(df, month_list, segment_col, color_map):
-    df_wide = df.pivot(
-        index='MemberAK',
-        columns='yearmon',
-        values=["RFM_Segment", "Affinität_Segment", "Lifecycle_Segment"]
+    """Pivot the segments of every member to one column per month.
+
+    Only the requested segment columns are pivoted, as categorical codes and
+    in a single pass. With several segment columns the columns are named
+    "<month> <segment column>". The color is given by the first segment
+    column in the last month.
+    """
+    if isinstance(segment_col, str):
+        segment_cols = [segment_col]
+    else:
+        segment_cols = list(segment_col)
+
+    code_member, members = pd.factorize(df["MemberAK"])
+    code_month = pd.Index(month_list).get_indexer(df["yearmon"])
+    is_month = (code_month >= 0) & (code_member >= 0)
+    code_member, code_month = code_member[is_month], code_month[is_month]
+    cells = code_member * len(month_list) + code_month
+    if np.bincount(cells).max(initial=0) > 1:
+        raise ValueError("Index contains duplicate entries, cannot reshape")
+
+    wide_dict = {}
+    for i, col in enumerate(segment_cols):
+        values = df[col].astype("category")
+        if i == 0:
+            # Segments of the color map first, in the order of the map
+            categories = list(color_map.keys()) + [
+                x for x in values.cat.categories if x not in color_map
+            ]
+            values = values.cat.set_categories(categories)
+        categories = values.cat.categories
+        codes = np.full((len(members), len(month_list)), -1, dtype=np.int16)
+        codes[code_member, code_month] = values.cat.codes.to_numpy()[is_month]
+        for j, month in enumerate(month_list):
+            name = month if len(segment_cols) == 1 else f"{month} {col}"
+            wide_dict[name] = pd.Categorical.from_codes(
+                codes[:, j], categories=categories
+            )
+        if i == 0:
+            color_codes = codes[:, -1]
+            color_lookup = [color_map.get(x, "#e5e6eb") for x in categories]
+
+    # Code -1 (missing) picks the last entry
+    colors, color_lookup = np.unique(color_lookup + ["#e5e6eb"], return_inverse=True)
+    wide_dict["color"] = pd.Categorical.from_codes(
+        color_lookup[color_codes], categories=colors
     )
-
-    df_wide = df_wide[[segment_col]].copy()
-    df_wide.columns = list(df_wide.columns.get_level_values("yearmon"))
-    # Make sure the columns are arranged in the right order
-    df_wide = df_wide.reindex(columns=month_list)
-    df_wide["color"] = df_wide.iloc[:, -1].apply(lambda x: color_map.get(x, "#e5e6eb"))
+    df_wide = pd.DataFrame(wide_dict, index=pd.Index(members, name="MemberAK"))
     return df_wide
 
 
-def display_parcats_over_time(df, month_list, title, color_map):
-
-    assert len(month_list) in (2, 3), "Set `n_months` to 2 or 3, please."
-
-    m1_dim = go.parcats.Dimension(
-        values=df[month_list[0]],
-        categoryorder="array",
-        categoryarray=list(color_map.keys()),
-        label=month_list[0]
+def create_path_df(df_wide):
+    """Count the members per distinct path of segments over the months."""
+    dims = [col for col in df_wide.columns if col != "color"]
+    codes = np.column_stack(
+        [df_wide[col].cat.codes.to_numpy().astype(np.int64) + 1 for col in dims]
     )
-
-    m2_dim = go.parcats.Dimension(
-        values=df[month_list[1]],
-        categoryorder="array",
-        categoryarray=list(color_map.keys()),
-        label=month_list[1]
-    )
-
-    if len(month_list) == 3:
-        m3_dim = go.parcats.Dimension(
-            values=df[month_list[2]],
+    # Pack every path into one integer if it fits, else compare rows
+    bases = [len(df_wide[col].cat.categories) + 1 for col in dims]
+    if np.sum(np.log2(bases)) < 63:
+        keys = np.zeros(len(codes), dtype=np.int64)
+        for j, base in enumerate(bases):
+            keys = keys * base + codes[:, j]
+    else:
+        _, keys = np.unique(codes, axis=0, return_inverse=True)
+    path_codes, _ = pd.factorize(keys.ravel())
+    counts = np.bincount(path_codes)
+    # Paths are numbered in order of appearance, so this is the first member
+    idx_first = np.unique(path_codes, return_index=True)[1]
+    df_paths = df_wide.iloc[idx_first].reset_index(drop=True)
+    df_paths["count"] = counts
+    return df_paths
+
+
+def display_parcats_over_time(df, title, show=True):
+    dimensions = [
+        go.parcats.Dimension(
+            values=df[col].astype(object),
             categoryorder="array",
-            categoryarray=list(color_map.keys()),
-            label=month_list[2]
+            categoryarray=list(df[col].cat.categories),
+            label=col,
         )
-
-        dimensions = [m1_dim, m2_dim, m3_dim]
-    else:
-        dimensions = [m1_dim, m2_dim]
+        for col in df.columns
+        if col not in ("color", "count")
+    ]
 
     fig = go.Figure(
         data=[
             go.Parcats(
                 dimensions=dimensions,
-                line={'color': df["color"]}
+                line={'color': df["color"].astype(object)},
+                # one row per path with its nr. of members if aggregated
+                counts=df["count"] if "count" in df.columns else 1,
             )
         ]
     )
 
     fig.update_layout(title_text=f"<b>{title}<br />")
 
-    fig.show()
+    if show:
+        fig.show()
+    return fig
@@ -0,0 +1,241 @@
+import base64
+import hashlib
+import html
+import json
+import os
+
+import numpy as np
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from plotly.utils import PlotlyJSONEncoder
+
+# plotly.js typed array dtypes, int64 is not supported by plotly.js
+TYPED_ARRAY_DTYPES = {
+    np.dtype("float64"): "f8",
+    np.dtype("float32"): "f4",
+    np.dtype("int32"): "i4",
+    np.dtype("uint32"): "u4",
+    np.dtype("int16"): "i2",
+    np.dtype("uint16"): "u2",
+    np.dtype("int8"): "i1",
+    np.dtype("uint8"): "u1",
+}
+# shorter numeric arrays are kept as json lists
+MIN_TYPED_LENGTH = 8
+# traces whose values must add up to their parents, never downcast
+HIERARCHICAL_TRACES = {"treemap", "sunburst", "icicle"}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{plotlyjs}
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+div.figure {{ width: 100%; margin-bottom: 3em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+<script>
+var templates = JSON.parse(document.getElementById("templates").textContent);
+
+function plot(div) {{
+    var fig = JSON.parse(document.getElementById(div.id + "-data").textContent);
+    if (fig.template) {{
+        fig.layout.template = templates[fig.template];
+    }}
+    Plotly.newPlot(div, fig.data, fig.layout, {{responsive: true}});
+}}
+
+var divs = document.querySelectorAll("div.figure");
+if ("IntersectionObserver" in window) {{
+    // plot figures only when they are scrolled into view
+    var observer = new IntersectionObserver(function(entries) {{
+        entries.forEach(function(entry) {{
+            if (entry.isIntersecting) {{
+                observer.unobserve(entry.target);
+                plot(entry.target);
+            }}
+        }});
+    }}, {{rootMargin: "300px"}});
+    divs.forEach(function(div) {{ observer.observe(div); }});
+}} else {{
+    divs.forEach(plot);
+}}
+</script>
+</body>
+</html>
+"""
+
+
+def write_report(
+    figures,
+    path,
+    title="Report",
+    include_plotlyjs="directory",
+    float_dtype="f8",
+):
+    """Write many figures to one html page that plots them lazily.
+
+    `figures` maps headings to figures. With `include_plotlyjs="directory"`
+    plotly.js is written once to plotly.min.js next to the page and shared
+    by all pages written to that directory, "cdn" loads it from the cdn
+    and "inline" embeds it. Numeric arrays are stored as base64 typed
+    arrays and templates are stored once per page. `float_dtype="f4"`
+    halves float arrays again at the cost of about 7 significant digits,
+    treemaps, sunbursts and icicles are kept in float64 as their parents
+    must be the exact sums of their children.
+
+    Returns the path of the page.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    templates = {}
+    sections = []
+    for i, (heading, fig) in enumerate(figures.items()):
+        fig_dict = fig.to_dict() if hasattr(fig, "to_dict") else dict(fig)
+        payload = compact_figure(fig_dict, float_dtype)
+        template = payload["layout"].pop("template", None)
+        if template is not None:
+            template_json = to_json(template)
+            key = hashlib.sha1(template_json.encode("utf-8")).hexdigest()[:12]
+            templates[key] = template_json
+            payload["template"] = key
+        height = payload["layout"].get("height", 450)
+        sections.append(
+            f"<h2>{html.escape(str(heading))}</h2>\n"
+            f'<div class="figure" id="fig-{i}" style="height: {height}px;">'
+            "</div>\n"
+            f'<script type="application/json" id="fig-{i}-data">'
+            f"{script_safe(to_json(payload))}</script>"
+        )
+    templates_json = "{" + ",".join(
+        f'"{key}":{value}' for key, value in templates.items()
+    ) + "}"
+    sections.append(
+        '<script type="application/json" id="templates">'
+        f"{script_safe(templates_json)}</script>"
+    )
+
+    page = PAGE_TEMPLATE.format(
+        title=html.escape(title),
+        plotlyjs=plotlyjs_tag(include_plotlyjs, directory),
+        body="\n".join(sections),
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(page)
+    return path
+
+
+def plotlyjs_tag(include_plotlyjs, directory):
+    """Return the script tag loading plotly.js, write it if needed."""
+    if include_plotlyjs == "directory":
+        path_js = os.path.join(directory, "plotly.min.js")
+        plotlyjs = get_plotlyjs()
+        if (
+            not os.path.exists(path_js)
+            or os.path.getsize(path_js) != len(plotlyjs.encode("utf-8"))
+        ):
+            with open(path_js, "w", encoding="utf-8") as f:
+                f.write(plotlyjs)
+        return '<script src="plotly.min.js"></script>'
+    if include_plotlyjs == "cdn":
+        return (
+            '<script src="https://cdn.plot.ly/'
+            f'plotly-{get_plotlyjs_version()}.min.js"></script>'
+        )
+    if include_plotlyjs == "inline":
+        return f"<script>{get_plotlyjs()}</script>"
+    raise ValueError('include_plotlyjs must be "directory", "cdn" or "inline".')
+
+
+def compact_figure(fig_dict, float_dtype="f8"):
+    """Encode the numeric arrays of the traces as base64 typed arrays."""
+    return {
+        "data": [
+            encode_arrays(
+                trace,
+                "f8" if trace.get("type") in HIERARCHICAL_TRACES else float_dtype,
+            )
+            for trace in fig_dict["data"]
+        ],
+        "layout": dict(fig_dict.get("layout", {})),
+    }
+
+
+def encode_arrays(value, float_dtype="f8"):
+    """Replace numeric arrays in a (nested) trace by typed array specs."""
+    if isinstance(value, dict):
+        if "bdata" in value and "dtype" in value:
+            value = decode_typed_array(value)
+        else:
+            return {
+                key: encode_arrays(item, float_dtype)
+                for key, item in value.items()
+            }
+    if isinstance(value, (list, tuple, np.ndarray)):
+        typed = typed_array(value, float_dtype)
+        if typed is not None:
+            return typed
+        if isinstance(value, np.ndarray):
+            # dates, strings, ... are serialised by plotly
+            return value
+        return [encode_arrays(item, float_dtype) for item in value]
+    return value
+
+
+def typed_array(value, float_dtype="f8"):
+    """Return the typed array spec of a numeric array, None otherwise."""
+    if len(value) < MIN_TYPED_LENGTH:
+        return None
+    try:
+        arr = np.asarray(value)
+    except ValueError:
+        # ragged nested lists
+        return None
+    if arr.dtype.kind == "f":
+        arr = arr.astype("<" + float_dtype)
+    elif arr.dtype.kind in "iu":
+        info = np.iinfo(np.int32)
+        if arr.size and (arr.min() < info.min or arr.max() > info.max):
+            arr = arr.astype("<f8")
+        elif arr.dtype.itemsize > 4:
+            arr = arr.astype("<i4")
+    else:
+        return None
+    arr = np.ascontiguousarray(arr.astype(arr.dtype.newbyteorder("<")))
+    spec = {
+        "dtype": TYPED_ARRAY_DTYPES[arr.dtype.newbyteorder("=")],
+        "bdata": base64.b64encode(arr.tobytes()).decode("ascii"),
+    }
+    if arr.ndim > 1:
+        spec["shape"] = ",".join(str(n) for n in arr.shape)
+    return spec
+
+
+def decode_typed_array(spec):
+    """Return the array of a typed array spec."""
+    dtypes = {code: dtype for dtype, code in TYPED_ARRAY_DTYPES.items()}
+    arr = np.frombuffer(
+        base64.b64decode(spec["bdata"]),
+        dtype=dtypes[spec["dtype"]].newbyteorder("<"),
+    )
+    if "shape" in spec:
+        shape = spec["shape"]
+        if isinstance(shape, str):
+            shape = [int(n) for n in shape.split(",")]
+        arr = arr.reshape(shape)
+    return arr
+
+
+def to_json(obj):
+    """Serialise without whitespace, numpy and pandas values included."""
+    return json.dumps(obj, cls=PlotlyJSONEncoder, separators=(",", ":"))
+
+
+def script_safe(text):
+    """Escape json for embedding it in a script tag."""
+    return text.replace("</", "<\\/")
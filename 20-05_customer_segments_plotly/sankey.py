@@ -1,4 +1,8 @@
+import os
+import re
+
 import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 
 
@@ -16,16 +20,22 @@ def create_wide_df_sankey(df, month_list, segment_col):
     df_wide = df_wide[month_list]
     df_wide["count"] = 1
 
-    df_wide = df_wide.groupby(month_list).agg({"count": "sum"}).reset_index()
+    df_wide = (
+        df_wide.groupby(month_list, observed=True)
+        .agg({"count": "sum"})
+        .reset_index()
+    )
     df_wide.columns = ["source", "target", "count"]
 
     return df_wide
 
 
-def display_sankey(df, cluster_value, month_list):
+def display_sankey(df, cluster_value, month_list, show=True):
     df_specific = create_specific_df_sankey(df, cluster_value)
     target_index = get_index_of_target_value(df_specific, cluster_value)
-    display_sankey_specific(df_specific, cluster_value, target_index, month_list)
+    return display_sankey_specific(
+        df_specific, cluster_value, target_index, month_list, show
+    )
 
 
 def create_specific_df_sankey(df, cluster_value):
@@ -41,7 +51,9 @@ def get_index_of_target_value(df, cluster_value):
     return df.loc[df['target'] == cluster_value].index[0]
 
 
-def display_sankey_specific(df, cluster_value, target_index, month_list):
+def display_sankey_specific(
+    df, cluster_value, target_index, month_list, show=True
+):
     fig = go.Figure(data=[go.Sankey(
         node=dict(
             pad=15,
@@ -58,9 +70,11 @@ def display_sankey_specific(df, cluster_value, target_index, month_list):
             target=np.arange(0, len(df)),
             value=df["count"],
             label=df["target"],
-            # customdata=df["pct"],  -- seems to be a bug, cannot pass
+            # a plain list, plotly does not take the series here
+            customdata=df["pct"].tolist(),
             hovertemplate=(
-                "<b>%{label} </b> <br>n: %{value:,.0f} <extra></extra>"
+                "<b>%{label} </b> <br>n: %{value:,.0f} <br>%{customdata:.1%}"
+                " <extra></extra>"
             )
         )
     )])
@@ -73,4 +87,134 @@ def display_sankey_specific(df, cluster_value, target_index, month_list):
         height=500,
     )
 
-    fig.show()
+    if show:
+        fig.show()
+    return fig
+
+
+def create_sankey_bundle(df):
+    """Compute the flows of all source segments in one pass.
+
+    Returns the flows with their share of the source and the node indices
+    of source and target, and the node labels shared by all sources,
+    ordered by the total count of the target segments.
+    """
+    nodes = (
+        df.groupby("target", observed=True)["count"]
+        .sum()
+        .sort_values(ascending=False, kind="stable")
+        .index.astype(object)
+        .tolist()
+    )
+    nodes += sorted(set(df["source"].astype(object)) - set(nodes))
+
+    df_flows = df.sort_values(
+        ["source", "count"], ascending=[True, False], kind="stable"
+    ).reset_index(drop=True)
+    df_flows["pct"] = df_flows["count"] / df_flows.groupby(
+        "source", observed=True
+    )["count"].transform("sum")
+    node_codes = pd.Index(nodes)
+    df_flows["source_index"] = node_codes.get_indexer(df_flows["source"])
+    df_flows["target_index"] = node_codes.get_indexer(df_flows["target"])
+    return df_flows, nodes
+
+
+def sankey_links(df_flows, cluster_value):
+    """Return the link attributes of one source segment."""
+    df_source = df_flows.loc[df_flows["source"] == cluster_value]
+    return dict(
+        source=df_source["source_index"].tolist(),
+        target=df_source["target_index"].tolist(),
+        value=df_source["count"].tolist(),
+        label=df_source["target"].astype(object).tolist(),
+        customdata=df_source["pct"].tolist(),
+    )
+
+
+def create_sankey_figure(df_flows, nodes, month_list, cluster_value):
+    """Build the sankey of one source segment on the shared nodes."""
+    fig = go.Figure(data=[go.Sankey(
+        node=dict(
+            pad=15,
+            thickness=20,
+            line={"color": "black", "width": 0.5},
+            label=nodes,
+            color="lightseagreen",
+            hovertemplate=(
+                "<b>%{label} </b> <br>Total: %{value:.3s} <extra></extra>"
+            )
+        ),
+        link=dict(
+            **sankey_links(df_flows, cluster_value),
+            hovertemplate=(
+                "<b>%{label} </b> <br>n: %{value:,.0f} <br>%{customdata:.1%}"
+                " <extra></extra>"
+            )
+        )
+    )])
+
+    fig.update_layout(
+        title_text=f"<b>{cluster_value}</b>: {month_list[0]} to {month_list[1]}",
+        font_size=10,
+        autosize=True,
+        width=800,
+        height=500,
+    )
+    return fig
+
+
+def create_sankey_figures(df_flows, nodes, month_list):
+    """Build the sankeys of all source segments, by source segment."""
+    sources = df_flows["source"].astype(object).unique()
+    return {
+        source: create_sankey_figure(df_flows, nodes, month_list, source)
+        for source in sources
+    }
+
+
+def create_sankey_dropdown(df_flows, nodes, month_list):
+    """Build one sankey with a dropdown to switch between source segments."""
+    sources = df_flows["source"].astype(object).unique()
+    fig = create_sankey_figure(df_flows, nodes, month_list, sources[0])
+    buttons = []
+    for source in sources:
+        links = sankey_links(df_flows, source)
+        buttons.append(dict(
+            label=source,
+            method="update",
+            args=[
+                {f"link.{key}": [values] for key, values in links.items()},
+                {"title.text": (
+                    f"<b>{source}</b>: {month_list[0]} to {month_list[1]}"
+                )},
+            ],
+        ))
+    fig.update_layout(
+        updatemenus=[dict(buttons=buttons, x=1, y=1.15, xanchor="right")]
+    )
+    return fig
+
+
+def display_sankey_bundle(df, month_list, show=True):
+    """Display one sankey with a dropdown over all source segments."""
+    df_flows, nodes = create_sankey_bundle(df)
+    fig = create_sankey_dropdown(df_flows, nodes, month_list)
+    if show:
+        fig.show()
+    return fig
+
+
+def write_sankey_figures(figures, directory):
+    """Write the sankeys to one html file per source segment.
+
+    plotly.js is written once to the directory and shared by the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for source, fig in figures.items():
+        name = re.sub(r"[^\w.-]", "_", str(source))
+        path = os.path.join(directory, f"sankey_{name}.html")
+        fig.write_html(path, include_plotlyjs="directory")
+        paths.append(path)
+    return paths
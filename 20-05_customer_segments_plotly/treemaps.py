@@ -23,11 +23,13 @@ cls_args = [cls_levels, cls_title, value_col, count_col, cls_color_map]
 aff_args = [aff_levels, aff_title, value_col, count_col, aff_color_map]
 
 
-def display_treemaps(df, levels, title, value_column, count_column, color_map):
+def display_treemaps(
+    df, levels, title, value_column, count_column, color_map, show=True
+):
     df_hier = create_hierarchical_df(
         df, levels, value_column, count_column, color_map
     )
-    display_treemap_by_value_count(df_hier, title)
+    return display_treemap_by_value_count(df_hier, title, show)
 
 
 def create_hierarchical_df(
@@ -36,51 +38,65 @@ def create_hierarchical_df(
     """
     Build a hierarchy of levels for Sunburst or Treemap charts.
     Levels are given starting from the bottom to the top of the hierarchy,
-    ie the last level corresponds to the root.
+    ie the last level corresponds to the root. The ids are the paths of
+    the labels up to the root, so any number of levels is supported.
     """
-    df_hierarchical = pd.DataFrame(
-        columns=["id", "parent", "label", "value", "count", "color"]
-    )
+    columns = [value_column]
+    if count_column is not None:
+        columns.append(count_column)
 
-    for i, level in enumerate(levels):
-        df_grouped = df.groupby(levels[i:]).sum().reset_index()
-        df_tree = pd.DataFrame(columns=list(df_hierarchical.columns))
-        df_tree["label"] = df_grouped[level].copy()
-        if i < len(levels) - 1:
-            df_tree["parent"] = df_grouped[levels[i + 1]].copy()
-            df_tree["id"] = (
-                df_tree["label"].astype(str)
-                + "/"
-                + df_tree["parent"].astype(str)
-            )
-        else:
-            df_tree["parent"] = "total"
-            df_tree["id"] = df_tree["label"].astype(str)
+    # aggregate once at the deepest level, parents are rolled up from it
+    df_grouped = df.groupby(levels, dropna=False, observed=True)[columns].sum()
 
-        df_tree["value"] = df_grouped[value_column]
-        if count_column is not None:
-            df_tree["count"] = df_grouped[count_column]
+    tree_list = []
+    for i, level in enumerate(levels):
+        df_level = df_grouped.groupby(
+            level=levels[i:], dropna=False, observed=True
+        ).sum()
+        labels = df_level.index.get_level_values(level)
+        # ids are built from the root: "label/.../root label"
+        keys = [
+            df_level.index.get_level_values(name).astype(str)
+            for name in levels[i:]
+        ]
+        paths = [keys[-1]]
+        for key in reversed(keys[:-1]):
+            paths.append(key + "/" + paths[-1])
+        ids = paths[-1]
+        parent_ids = paths[-2] if len(paths) > 1 else ["total"] * len(ids)
+
+        df_tree = pd.DataFrame({
+            "id": ids,
+            "parent": parent_ids,
+            "label": labels.astype(object),
+            "value": df_level[value_column].to_numpy(),
+            "count": (
+                df_level[count_column].to_numpy()
+                if count_column is not None
+                else None
+            ),
+        })
         if color_map is not None:
-            df_tree["color"] = df_tree["label"].apply(
-                lambda x: color_map.get(x, "#e5e6eb")
-            )
-
-        df_hierarchical = df_hierarchical.append(df_tree, ignore_index=True)
+            df_tree["color"] = df_tree["label"].map(color_map).fillna("#e5e6eb")
+        else:
+            df_tree["color"] = None
+        tree_list.append(df_tree)
 
     total = {
         "id": "total",
         "parent": "",
         "label": "total",
         "value": df[value_column].sum(),
-        "count": df[count_column].sum(),
+        "count": df[count_column].sum() if count_column is not None else None,
         "color": "#ffffff",
     }
+    tree_list.append(pd.DataFrame([total]))
 
-    df_hierarchical = df_hierarchical.append(total, ignore_index=True)
+    df_hierarchical = pd.concat(tree_list, ignore_index=True)
     return df_hierarchical
 
 
-def display_treemap_by_value_count(df, title):
+def display_treemap_by_value_count(df, title, show=True):
 
     fig = make_subplots(
         rows=2,
@@ -135,4 +151,6 @@ def display_treemap_by_value_count(df, title):
 
     fig.update_layout(height=1000,)
 
-    fig.show()
+    if show:
+        fig.show()
+    return fig
@@ -1,5 +1,11 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from pandas.api.types import union_categoricals
+from sqlalchemy import bindparam, column, create_engine, func, select, text
+from sqlalchemy import table as sa_table
 
 
 rfm_color_map = {
@@ -31,63 +37,227 @@ aff_color_map = {
 }
 
 
-def get_segments_data(yearmon_dict):
-    _, connection = connect_to_db()
-    query = complete_query(yearmon_dict)
+SEGMENTS_TABLE = "xxx_analytics.dbo.xxx_segments_hist"
+SEGMENT_COLS = ["RFM_Segment", "Lifecycle_Segment", "Affinität_Segment"]
+FETCH_BATCH_SIZE = 100_000
+
+CON_STR = "mssql+pyodbc://@agtst01/xxx_analytics?driver=ODBC Driver 13 for SQL Server"
+# nr. of connections kept open and nr. of additional ones
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# seconds after which a pooled connection is replaced
+POOL_RECYCLE = 60 * 60
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_segments_data(
+    yearmon_dict,
+    aggregate=False,
+    connection=None,
+    table=SEGMENTS_TABLE,
+    columns=None,
+    filters=None,
+):
+    """Return segments data of the months in yearmon_dict.
+
+    With `aggregate=True` the database sums monetary and counts the members
+    per month and segment combination, which is all the treemaps need.
+    The pivots of parcats and sankey need the default row-level data.
+    `columns` restricts the segment columns, `filters` maps columns to
+    lists of values to keep, e.g. {"RFM_Segment": ["Loyals"]}.
+    """
+    if connection is None:
+        with get_engine().connect() as connection:
+            return get_segments_data(
+                yearmon_dict, aggregate, connection, table, columns, filters
+            )
+    query, params = complete_query(
+        yearmon_dict, aggregate, table, columns, filters
+    )
     print("Fetching data ...\n")
-    data = fetch_data(connection, query)
+    # sums of the aggregated data need the precision of float64
+    data = fetch_data(connection, query, params, downcast=not aggregate)
     print("Preparing dataframe ...\n")
-    df = prepare_dataframe(data, yearmon_dict)
+    df = prepare_dataframe(data, yearmon_dict, downcast=not aggregate)
     print("Done!")
     return df
 
 
+def get_engine(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW):
+    """Return the shared engine to DB on B2B2C server, created on first use.
+
+    Its pool checks connections with a ping before handing them out.
+    The pool settings only apply when the engine is created.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(
+                CON_STR,
+                fast_executemany=True,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_recycle=POOL_RECYCLE,
+                pool_pre_ping=True,
+            )
+    return _engine
+
+
 def connect_to_db():
-    """Return engine and connection to DB on B2B2C server."""
-    con_str = "mssql+pyodbc://@agtst01/xxx_analytics?driver=ODBC Driver 13 for SQL Server"
-    engine = create_engine(con_str, fast_executemany=True)
+    """Return engine and a new connection to DB on B2B2C server.
+
+    The engine is shared, the caller closes the connection to return it to
+    the pool.
+    """
+    engine = get_engine()
     connection = engine.connect()
     return engine, connection
 
 
-def complete_query(yearmon_dict):
-    query = f"""
-        SELECT
-            yearmon,
-            MemberAK,
-            RFM_Segment,
-            Lifecycle_Segment,
-            Affinität_Segment,
-            monetary
-        FROM xxx_analytics.dbo.xxx_segments_hist
-        WHERE yearmon in ({", ".join(str(x) for x in list(yearmon_dict.keys()))})
-        """
+def complete_query(
+    yearmon_dict, aggregate=False, table=SEGMENTS_TABLE, columns=None, filters=None
+):
+    """Return the select statement and its parameters.
+
+    All values are bound parameters, so the statement only depends on the
+    shape of the request and is built and compiled once per shape.
+    """
+    columns = tuple(SEGMENT_COLS if columns is None else columns)
+    filters = {} if filters is None else filters
+    query = segments_statement(table, columns, tuple(sorted(filters)), aggregate)
+    params = {"yearmon": list(yearmon_dict.keys())}
+    params.update({f"filter_{col}": list(vals) for col, vals in filters.items()})
+    return query, params
+
+
+@lru_cache(maxsize=None)
+def segments_statement(table, columns, filter_cols, aggregate):
+    """Build the select statement on the segments table for one shape."""
+    schema, _, name = table.rpartition(".")
+    cols = {"yearmon", "MemberAK", "monetary", *SEGMENT_COLS, *filter_cols}
+    tbl = sa_table(name, *[column(col) for col in cols], schema=schema or None)
+    query = select(tbl.c.yearmon)
+    if aggregate:
+        query = query.add_columns(
+            *[tbl.c[col] for col in columns],
+            func.sum(tbl.c.monetary).label("monetary"),
+            func.count().label("count"),
+        ).group_by(tbl.c.yearmon, *[tbl.c[col] for col in columns])
+    else:
+        query = query.add_columns(
+            tbl.c.MemberAK, *[tbl.c[col] for col in columns], tbl.c.monetary
+        )
+    query = query.where(tbl.c.yearmon.in_(bindparam("yearmon", expanding=True)))
+    for col in filter_cols:
+        query = query.where(
+            tbl.c[col].in_(bindparam(f"filter_{col}", expanding=True))
+        )
     return query
 
 
-def fetch_data(connection, query):
-    return connection.execute(query).fetchall()
+def fetch_data(
+    connection, query, params=None, batch_size=FETCH_BATCH_SIZE, downcast=True
+):
+    """Stream the result with a server-side cursor into a compact dataframe.
+
+    Every batch is turned into columnar arrays right away, with categorical
+    segment columns and, with `downcast=True`, float32 monetary of the
+    row-level data, so peak memory stays close to the size of the final
+    dataframe. Keep `downcast=False` for summed monetary. Compiled statements
+    are reused from the cache of the engine.
+    """
+    if isinstance(query, str):
+        query = text(query)
+    # options of this execution only, the connection of the caller is kept
+    result = connection.execute(
+        query,
+        params or {},
+        execution_options={"stream_results": True},
+    )
+    columns = list(result.keys())
+    batches = []
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        batches.append(compact_batch(columns, rows, downcast))
+    result.close()
+    if not batches:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame({
+        col: (
+            union_categoricals([batch[col] for batch in batches])
+            if col in SEGMENT_COLS
+            else np.concatenate([batch[col] for batch in batches])
+        )
+        for col in columns
+    })
+
 
+def compact_batch(columns, rows, downcast=True):
+    """Return columnar arrays of a batch of rows."""
+    batch = {}
+    for col, values in zip(columns, zip(*rows)):
+        if col in SEGMENT_COLS:
+            batch[col] = pd.Categorical(values)
+        elif col == "monetary":
+            batch[col] = np.array(
+                values, dtype=np.float32 if downcast else np.float64
+            )
+        else:
+            batch[col] = np.array(values)
+    return batch
 
-def prepare_dataframe(data, yearmon_dict):
-    df = pd.DataFrame(data, columns=data[0].keys())
 
+def prepare_dataframe(df, yearmon_dict, downcast=True):
     # Redefine datatypes were necessary
-    df = df.astype({"monetary": float, "MemberAK": str,})
+    df = df.astype({"monetary": np.float32 if downcast else np.float64})
+    if "MemberAK" in df.columns:
+        df = df.astype({"MemberAK": str})
+    segment_cols = [col for col in SEGMENT_COLS if col in df.columns]
+    for col in segment_cols:
+        df[col] = df[col].astype("category")
 
     # Rename some variables (for improved readability)
-    df["yearmon"] = df["yearmon"].map(yearmon_dict)
-    df["Affinität_Segment"] = df["Affinität_Segment"].str.replace(
-        "Missing SAP Product Categories", "Missing SAP"
-    )
-    df["Lifecycle_Segment"] = df["Lifecycle_Segment"].str.replace(
-        "Regularly Active Customer", "Regularly Active"
+    codes = pd.Index(list(yearmon_dict.keys())).get_indexer(df["yearmon"])
+    df["yearmon"] = pd.Categorical.from_codes(
+        codes, categories=list(yearmon_dict.values())
     )
+    if "Affinität_Segment" in segment_cols:
+        df["Affinität_Segment"] = replace_categories(
+            df["Affinität_Segment"], "Missing SAP Product Categories", "Missing SAP"
+        )
 
-    # Fill in a string for the missing affinites segments
-    df["Affinität_Segment"].fillna("None", inplace=True)
+        # Fill in a string for the missing affinites segments
+        if "None" not in df["Affinität_Segment"].cat.categories:
+            df["Affinität_Segment"] = df["Affinität_Segment"].cat.add_categories(
+                "None"
+            )
+        df["Affinität_Segment"] = df["Affinität_Segment"].fillna("None")
+    if "Lifecycle_Segment" in segment_cols:
+        df["Lifecycle_Segment"] = replace_categories(
+            df["Lifecycle_Segment"], "Regularly Active Customer", "Regularly Active"
+        )
 
-    # Add a count column for the treemap plots
-    df["count"] = 1
+    # Add a count column for the treemap plots (aggregated data has counts)
+    if "count" not in df.columns:
+        df["count"] = 1
 
     return df
+
+
+def replace_categories(s, old, new):
+    """Replace `old` by `new` in the categories of s, not in every row.
+
+    Categories that become equal are merged.
+    """
+    categories = s.cat.categories.astype(str).str.replace(old, new, regex=False)
+    category_codes, uniques = pd.factorize(categories)
+    codes = s.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, category_codes[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=uniques),
+        index=s.index,
+        name=s.name,
+    )
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+import pytest
+
+from utils.utils import alluvial, to_alluvial, unique_labels
+
+SEGMENTS = [
+    "Active", "Dormant", "Inactive", "Premium", "Revolver", "Transactor",
+    "Churner", "Gold", "Silver", "Student", "Traveller", "Young"
+]
+
+
+def reference_to_alluvial(df: pd.DataFrame, direction: str) -> tuple:
+    """former merge chain of to_alluvial, alluvial_info, alluvial_colors and
+    plotly_labels the links of alluvial_links are compared against"""
+    l_df_lookup, l_dtypes = unique_labels(df)
+    df["source"] = df["source"].astype(l_dtypes[0])
+    df["target"] = df["target"].astype(l_dtypes[1])
+
+    df_alluvial = (
+        df.merge(
+            l_df_lookup[0], how="inner", left_on="source", right_on="labels"
+        ).drop(columns=["source", "labels"]
+               ).rename(columns={
+                   "values": "source"
+               }).merge(
+                   l_df_lookup[1],
+                   how="inner",
+                   left_on="target",
+                   right_on="labels"
+               ).drop(columns=["target", "labels"]
+                      ).rename(columns={"values": "target"})
+    )
+    df_alluvial["target"] = df_alluvial["target"] + df_alluvial["source"].max(
+    ) + 1
+    df_alluvial.rename(columns={"n_accounts": "value"}, inplace=True)
+
+    colors = pio.templates["plotly"]["layout"]["colorway"]
+    vals = sorted(df_alluvial[direction].unique())
+    df_colors = pd.DataFrame({direction: vals, "color": colors[0:len(vals)]})
+
+    df_alluvial = df_alluvial.sort_values(["source", "target"])
+    df_alluvial = df_alluvial.merge(df_colors, how="inner", on=direction)
+    df_alluvial = df_alluvial.assign(
+        label=np.round(
+            df_alluvial["value"] /
+            df_alluvial.groupby(direction)["value"].transform("sum"), 2
+        )
+    )
+    return df_alluvial, df
+
+
+def base_agg(seed: int, n_segments: int) -> pd.DataFrame:
+    """shuffled source x target counts incl. new and lost customers, some
+    combinations missing"""
+    rng = np.random.default_rng(seed)
+    segments = list(rng.permutation(SEGMENTS[:n_segments]))
+    df = pd.DataFrame(
+        [
+            (source, target)
+            for source in segments + ["New Customer"]
+            for target in segments + ["Lost Customer"]
+        ],
+        columns=["source", "target"],
+    )
+    df["n_accounts"] = rng.integers(1, 1000, len(df))
+    df = df.sample(frac=0.8, random_state=seed)
+    return df.reset_index(drop=True)
+
+
+@pytest.mark.parametrize("direction", ["source", "target"])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_segments", [1, 3, 6])
+def test_alluvial_links_match_merge_chain(direction, seed, n_segments):
+    df = base_agg(seed, n_segments)
+    df_alluvial, df_labels = to_alluvial(df.copy(), [], direction)
+    df_reference, df_labels_reference = reference_to_alluvial(
+        df.copy(), direction
+    )
+
+    pd.testing.assert_frame_equal(
+        df_alluvial.reset_index(drop=True),
+        df_reference[df_alluvial.columns].reset_index(drop=True),
+        check_dtype=False,
+    )
+    sankey = alluvial(df_labels, df_alluvial).data[0]
+    sankey_reference = alluvial(df_labels_reference, df_reference).data[0]
+    assert sankey.node.label == sankey_reference.node.label
+    assert sankey.link.to_plotly_json() == (
+        sankey_reference.link.to_plotly_json()
+    )
+
+
+@pytest.mark.parametrize("direction", ["source", "target"])
+@pytest.mark.parametrize("n_segments", [3, 12])
+def test_alluvial_nodes_have_the_colors_of_their_links(direction, n_segments):
+    df = base_agg(0, n_segments)
+    df_alluvial, df_labels = to_alluvial(df, [], direction)
+    sankey = alluvial(df_labels, df_alluvial).data[0]
+
+    assert len(sankey.node.color) == len(sankey.node.label)
+    node_color = np.asarray(sankey.node.color)
+    link_node = np.asarray(sankey.link[direction])
+    assert (node_color[link_node] == np.asarray(sankey.link.color)).all()
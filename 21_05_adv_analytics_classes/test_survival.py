@@ -0,0 +1,135 @@
+from datetime import datetime
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.survival import (
+    create_df_survival, create_df_survival_bands,
+    create_df_survival_from_state, survival_state
+)
+
+KEY_COLS = ["group_name", "cohort", "status_full", "n_days_to_invalid"]
+COMPARED_COLS = [
+    "n_accounts", "n_accounts_tot", "prop_dropout", "n_dropout_cum",
+    "prop_survive"
+]
+
+
+def reference_create_df_survival(
+    df_ncas: pd.DataFrame, n_min: int
+) -> pd.DataFrame:
+    """former cross join of groups x cohorts x days x statuses the sparse
+    survival curves are compared against"""
+    df_survival = df_ncas.query("month_nr == 1 and is_valid == 1")
+    max_days = (
+        datetime.now() - df_survival.groupby("cohort")["bearbeitet_datum"].max()
+    ).dt.days.reset_index().rename(columns={"bearbeitet_datum": "max_n_days"})
+    df_survival_agg = (
+        df_survival.groupby(
+            ["group_name", "cohort", "status_full"]
+        )["n_days_to_invalid"].value_counts().rename("n_accounts").reset_index()
+    )
+    df_design = reduce(
+        lambda x, y: pd.merge(x, y, how="cross"),
+        [
+            pd.DataFrame({"group_name": df_survival["group_name"].unique()}),
+            pd.DataFrame({"cohort": df_survival["cohort"].unique()}),
+            pd.DataFrame({
+                "n_days_to_invalid":
+                    range(1, int(max_days["max_n_days"].max()))
+            }),
+            pd.DataFrame({
+                "status_full": df_survival["status_full"].cat.categories
+            }),
+        ]
+    )
+    df_survival_agg = df_design.merge(
+        df_survival_agg,
+        how="left",
+        on=["n_days_to_invalid", "group_name", "cohort", "status_full"]
+    )
+    df_survival_agg["n_accounts"] = df_survival_agg["n_accounts"].fillna(0)
+    df_tmp = (
+        df_survival.groupby(
+            ["group_name", "cohort", "status_full"]
+        )["konto_id"].count().rename("n_accounts_tot").reset_index()
+    )
+    df_survival_agg = (
+        df_survival_agg.merge(
+            df_tmp, how="inner", on=["group_name", "cohort", "status_full"]
+        )
+    )
+    df_survival_agg = df_survival_agg.merge(max_days, how="inner", on="cohort")
+    df_survival_agg = df_survival_agg.query("n_days_to_invalid <= max_n_days")
+    df_survival_agg["prop_dropout"] = (
+        df_survival_agg.eval("n_accounts / n_accounts_tot")
+    )
+    df_survival_agg["n_dropout_cum"] = df_survival_agg.groupby(
+        ["group_name", "cohort", "status_full"]
+    )["n_accounts"].cumsum()
+    df_survival_agg["prop_survive"] = 1 - df_survival_agg.groupby(
+        ["group_name", "cohort", "status_full"]
+    )["prop_dropout"].cumsum()
+    return df_survival_agg.query("n_accounts_tot > @n_min")
+
+
+def ncas(n: int, with_dropouts: bool, seed: int = 0) -> pd.DataFrame:
+    """valid first-month ncas of the last 30 to 90 days, about half of them
+    dropping out if with_dropouts, else none, as for a recent start date"""
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.now().normalize()
+    n_days_to_invalid = rng.integers(1, 30, n).astype(float)
+    is_censored = rng.random(n) < 0.5 if with_dropouts else np.ones(n, bool)
+    n_days_to_invalid[is_censored] = np.nan
+    return pd.DataFrame({
+        "konto_id": np.arange(n),
+        "jamo": 202001,
+        "month_nr": 1,
+        "is_valid": 1,
+        "bearbeitet_datum":
+            today - pd.to_timedelta(rng.integers(30, 90, n), "D"),
+        "status_full":
+            pd.Categorical(rng.choice(["Approved CCF", "Declined"], n)),
+        "group_name": rng.choice(["A", "B", "C"], n),
+        "cohort": rng.choice(["2020-01", "2020-02"], n),
+        "n_days_to_invalid": n_days_to_invalid,
+    })
+
+
+def sorted_survival(df_survival_agg: pd.DataFrame) -> pd.DataFrame:
+    df_survival_agg = df_survival_agg.astype({"status_full": str})
+    return (
+        df_survival_agg.sort_values(KEY_COLS)[KEY_COLS + COMPARED_COLS]
+        .reset_index(drop=True)
+    )
+
+
+@pytest.mark.parametrize("with_dropouts", [True, False])
+@pytest.mark.parametrize("n", [50, 600])
+def test_create_df_survival_matches_cross_join(n, with_dropouts):
+    df_ncas = ncas(n, with_dropouts)
+    pd.testing.assert_frame_equal(
+        sorted_survival(create_df_survival(df_ncas, 5)),
+        sorted_survival(reference_create_df_survival(df_ncas, 5)),
+        check_dtype=False,
+    )
+
+
+def test_survival_without_dropouts():
+    df_ncas = ncas(50, with_dropouts=False)
+    df_survival_agg = create_df_survival(df_ncas, 5)
+    for df in [
+        df_survival_agg,
+        create_df_survival(df_ncas, 5, per_account=True),
+        create_df_survival_bands(df_ncas, 5),
+        create_df_survival_from_state(survival_state(df_ncas), 5),
+    ]:
+        assert len(df) > 0
+        assert (df["prop_survive"] == 1).all()
+        assert (df["n_accounts"] == 0).all()
+    pd.testing.assert_frame_equal(
+        create_df_survival_from_state(survival_state(df_ncas), 5),
+        df_survival_agg,
+    )
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable
+
+import pandas as pd
+
+CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "adv_analytics_classes"
+)
+# seconds until a cached result is reloaded, None to keep results forever
+CACHE_TTL = 24 * 60 * 60
+# total size of the cache in bytes, least recently used results are evicted
+CACHE_MAX_BYTES = 5 * 1024**3
+# default of ttl and max_bytes, None is a valid value of both
+_DEFAULT = object()
+
+
+def cached(
+    procedure: str,
+    params: dict,
+    load: Callable[[], pd.DataFrame],
+    ttl: float = _DEFAULT,
+    max_bytes: int = _DEFAULT,
+    cache_dir: str = None
+) -> pd.DataFrame:
+    """return result of a stored procedure from the parquet cache,
+    call load and cache its result if there is no valid entry
+
+    Parameters
+    ----------
+    procedure : str
+        name of the stored procedure
+    params : dict
+        parameters of the stored procedure (incl. sql strings)
+    load : Callable[[], pd.DataFrame]
+        function executing the procedure and returning the result
+    ttl : float, optional
+        seconds until the entry expires, None to keep it forever, by default
+        CACHE_TTL
+    max_bytes : int, optional
+        size bound of the cache, None for no bound, by default
+        CACHE_MAX_BYTES
+    cache_dir : str, optional
+        directory of the cache, by default CACHE_DIR
+
+    Returns
+    -------
+    pd.DataFrame
+        result of the procedure
+    """
+    ttl = CACHE_TTL if ttl is _DEFAULT else ttl
+    max_bytes = CACHE_MAX_BYTES if max_bytes is _DEFAULT else max_bytes
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = cache_path(procedure, params, cache_dir)
+    if os.path.exists(path):
+        try:
+            stat = os.stat(path)
+            if ttl is None or time.time() - stat.st_mtime < ttl:
+                # atime marks the last access, mtime the time of loading
+                os.utime(path, (time.time(), stat.st_mtime))
+                return pd.read_parquet(path, memory_map=True)
+        except FileNotFoundError:
+            # evicted by a concurrent call, load again
+            pass
+    df = load()
+    os.makedirs(cache_dir, exist_ok=True)
+    # unique per thread, concurrent loads of the same entry do not collide
+    path_tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    df.to_parquet(path_tmp, index=False)
+    os.replace(path_tmp, path)
+    evict(max_bytes, cache_dir)
+    return df
+
+
+def cache_path(procedure: str, params: dict, cache_dir: str = None) -> str:
+    """return path of the cache entry for a procedure and its parameters
+
+    Parameters
+    ----------
+    procedure : str
+        name of the stored procedure
+    params : dict
+        parameters of the stored procedure
+    cache_dir : str, optional
+        directory of the cache, by default CACHE_DIR
+
+    Returns
+    -------
+    str
+        path of the parquet file
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    key = json.dumps(
+        {
+            "procedure": procedure,
+            "params": params
+        }, sort_keys=True, default=str
+    )
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(cache_dir, f"{file_prefix(procedure)}{digest}.parquet")
+
+
+def file_prefix(procedure: str) -> str:
+    """return file name prefix of all entries of a procedure"""
+    return re.sub(r"[^\w.]", "_", procedure) + "-"
+
+
+def evict(max_bytes: int, cache_dir: str = None) -> None:
+    """remove least recently used entries until the cache fits max_bytes
+
+    Parameters
+    ----------
+    max_bytes : int
+        size bound of the cache, None for no bound
+    cache_dir : str, optional
+        directory of the cache, by default CACHE_DIR
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if max_bytes is None or not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".parquet"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                # removed by a concurrent call
+                continue
+            entries.append((stat.st_atime, stat.st_size, name))
+    n_bytes = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if n_bytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        n_bytes -= size
+
+
+def invalidate(
+    procedure: str = None, params: dict = None, cache_dir: str = None
+) -> int:
+    """remove cache entries, all of them if no procedure is passed,
+    all of a procedure if no parameters are passed
+
+    Parameters
+    ----------
+    procedure : str, optional
+        name of the stored procedure, by default None
+    params : dict, optional
+        parameters of the stored procedure, by default None
+    cache_dir : str, optional
+        directory of the cache, by default CACHE_DIR
+
+    Returns
+    -------
+    int
+        nr. of removed entries
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not os.path.isdir(cache_dir):
+        return 0
+    if procedure is not None and params is not None:
+        names = [os.path.basename(cache_path(procedure, params, cache_dir))]
+    else:
+        prefix = "" if procedure is None else file_prefix(procedure)
+        names = [
+            name for name in os.listdir(cache_dir)
+            if name.startswith(prefix) and name.endswith(".parquet")
+        ]
+    n_removed = 0
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+            n_removed += 1
+    return n_removed
@@ -0,0 +1,115 @@
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+import bcag
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+# nr. of connections kept open per engine and nr. of additional ones
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# seconds after which a pooled connection is replaced
+POOL_RECYCLE = 60 * 60
+# dialect options of the bcag engine taken over, e.g. of mssql+pyodbc
+DIALECT_OPTIONS = ["fast_executemany"]
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_engine(
+    server: str,
+    env: str,
+    database: str = None,
+    pool_size: int = None,
+    max_overflow: int = None
+):
+    """return the shared engine of a bcag connection, created on first use
+
+    The engine gets a queue pool which checks connections with a ping
+    before handing them out, so dropped connections are replaced. The
+    connections themselves are opened by the bcag engine, so its connect
+    arguments and connect hooks apply. Of the engine options only the
+    execution options and DIALECT_OPTIONS of the bcag engine are taken
+    over, add further dialect options there if bcag.connect sets them.
+
+    Parameters
+    ----------
+    server : str
+        server as passed to bcag.connect, e.g. "jemas"
+    env : str
+        environment as passed to bcag.connect, e.g. "prod"
+    database : str, optional
+        database as passed to bcag.connect, by default None
+    pool_size : int, optional
+        nr. of pooled connections, by default POOL_SIZE, only used when the
+        engine is created
+    max_overflow : int, optional
+        nr. of connections beyond pool_size, by default MAX_OVERFLOW, only
+        used when the engine is created
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+        shared engine
+    """
+    key = (server, env, database)
+    with _lock:
+        if key not in _engines:
+            args = key if database is not None else key[:2]
+            bcag_engine = bcag.connect(*args)
+            dialect_options = {
+                option: getattr(bcag_engine.dialect, option)
+                for option in DIALECT_OPTIONS
+                if hasattr(bcag_engine.dialect, option)
+            }
+            engine = create_engine(
+                bcag_engine.url,
+                creator=partial(detached_connection, bcag_engine),
+                poolclass=QueuePool,
+                pool_size=POOL_SIZE if pool_size is None else pool_size,
+                max_overflow=(
+                    MAX_OVERFLOW if max_overflow is None else max_overflow
+                ),
+                pool_recycle=POOL_RECYCLE,
+                pool_pre_ping=True,
+                execution_options=bcag_engine.get_execution_options(),
+                **dialect_options,
+            )
+            _engines[key] = engine
+        return _engines[key]
+
+
+def detached_connection(engine):
+    """open a dbapi connection with engine and detach it from its pool,
+    closing it is left to the pool of the shared engine"""
+    con = engine.raw_connection()
+    con.detach()
+    return con.dbapi_connection
+
+
+@contextmanager
+def connection(server: str, env: str, database: str = None):
+    """yield a pooled connection of the shared engine, returned to the pool
+    on exit
+
+    Parameters
+    ----------
+    server : str
+        server as passed to bcag.connect, e.g. "jemas"
+    env : str
+        environment as passed to bcag.connect, e.g. "prod"
+    database : str, optional
+        database as passed to bcag.connect, by default None
+    """
+    with get_engine(server, env, database).connect() as con:
+        yield con
+
+
+def dispose_engines() -> None:
+    """close all pooled connections and forget the shared engines"""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
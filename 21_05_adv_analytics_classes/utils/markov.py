@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+NEW = "New Customer"
+LOST = "Lost Customer"
+
+
+def count_matrix(df_base_agg: pd.DataFrame) -> tuple:
+    """turn the aggregated dataframe returned by counts into a dense
+    source x target count matrix
+
+    Parameters
+    ----------
+    df_base_agg : pd.DataFrame
+        aggregated dataframe with source, target and n_accounts
+
+    Returns
+    -------
+    tuple
+        n_accounts: np.ndarray
+            counts of shape (n_labels, n_labels)
+        labels: list
+            sorted labels of source and target
+    """
+    labels = sorted(
+        set(df_base_agg["source"]) | set(df_base_agg["target"]) | {NEW, LOST}
+    )
+    lookup = pd.Series(np.arange(len(labels)), index=labels)
+    n_accounts = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    np.add.at(
+        n_accounts,
+        (
+            df_base_agg["source"].map(lookup).to_numpy(),
+            df_base_agg["target"].map(lookup).to_numpy()
+        ),
+        df_base_agg["n_accounts"].to_numpy(),
+    )
+    return n_accounts, labels
+
+
+def transition_matrix(n_accounts: np.ndarray, labels: list) -> tuple:
+    """turn source x target counts into a row-stochastic transition matrix
+    over the segments and the absorbing "Lost Customer" state,
+    "New Customer" is split off as the distribution of the inflow
+
+    Parameters
+    ----------
+    n_accounts : np.ndarray
+        counts of shape (..., n_labels, n_labels), leading axes are batch
+        axes, e.g. periods as returned by transitions or stacked cohorts
+    labels : list
+        labels of the last two axes incl. "New Customer" and "Lost Customer"
+
+    Returns
+    -------
+    tuple
+        p: np.ndarray
+            transition matrices of shape (..., n_states, n_states)
+        inflow: np.ndarray
+            counts of new customers per state of shape (..., n_states)
+        states: list
+            labels of the states, "Lost Customer" is the last one
+    """
+    labels = list(labels)
+    idx = [i for i, label in enumerate(labels) if label not in (NEW, LOST)]
+    idx.append(labels.index(LOST))
+    n_accounts = np.asarray(n_accounts, dtype=float)
+    inflow = n_accounts[..., labels.index(NEW), idx]
+    p = n_accounts[..., idx, :][..., idx]
+    # lost customers stay lost
+    p[..., -1, :] = 0
+    n_out = p.sum(axis=-1, keepdims=True)
+    # states without outflow are treated as absorbing
+    eye = np.broadcast_to(np.eye(len(idx)), p.shape)
+    p = np.where(n_out > 0, p / np.where(n_out > 0, n_out, 1), eye)
+    return p, inflow, [labels[i] for i in idx]
+
+
+def project(
+    p: np.ndarray,
+    sizes: np.ndarray,
+    horizons: list,
+    inflow: np.ndarray = None
+) -> np.ndarray:
+    """project state sizes over several horizons, the matrix powers are
+    computed by exponentiation by squaring on the gaps between horizons
+
+    Parameters
+    ----------
+    p : np.ndarray
+        transition matrices of shape (..., n_states, n_states)
+    sizes : np.ndarray
+        state sizes at horizon 0 of shape (..., n_states)
+    horizons : list
+        nr. of periods to project, e.g. [1, 3, 12]
+    inflow : np.ndarray, optional
+        new customers per state and period of shape (..., n_states),
+        by default no inflow
+
+    Returns
+    -------
+    np.ndarray
+        projected sizes of shape (..., n_horizons, n_states) in the order
+        of horizons
+    """
+    horizons = np.asarray(horizons, dtype=int)
+    if (horizons < 0).any():
+        raise ValueError("horizons must not be negative")
+    sizes = np.asarray(sizes, dtype=float)
+    shape = np.broadcast_shapes(p.shape[:-1], sizes.shape)
+    projected = np.empty(shape[:-1] + (len(horizons), shape[-1]))
+    if inflow is not None:
+        # augment by a source state emitting the inflow in every period
+        n_states = p.shape[-1]
+        p_aug = np.zeros(
+            np.broadcast_shapes(p.shape[:-2], inflow.shape[:-1]) +
+            (n_states + 1, n_states + 1)
+        )
+        p_aug[..., :-1, :-1] = p
+        p_aug[..., -1, :-1] = inflow
+        p_aug[..., -1, -1] = 1
+        sizes_aug = np.concatenate(
+            [
+                np.broadcast_to(sizes, p_aug.shape[:-2] + (n_states, )),
+                np.ones(p_aug.shape[:-2] + (1, ))
+            ],
+            axis=-1
+        )
+        return project(p_aug, sizes_aug, horizons)[..., :-1]
+    current, n_done = np.broadcast_to(sizes, shape).copy(), 0
+    for i in np.argsort(horizons, kind="stable"):
+        if horizons[i] > n_done:
+            step = np.linalg.matrix_power(p, int(horizons[i] - n_done))
+            current = np.einsum("...i,...ij->...j", current, step)
+            n_done = horizons[i]
+        projected[..., i, :] = current
+    return projected
+
+
+def stationary_distribution(p: np.ndarray) -> np.ndarray:
+    """return the stationary distribution, i.e. the left eigenvector of
+    eigenvalue 1, of every transition matrix
+
+    With an absorbing "Lost Customer" state all mass ends up there, use
+    steady_state for the segment sizes under a constant inflow.
+
+    Parameters
+    ----------
+    p : np.ndarray
+        transition matrices of shape (..., n_states, n_states)
+
+    Returns
+    -------
+    np.ndarray
+        distributions of shape (..., n_states)
+    """
+    eigvals, eigvecs = np.linalg.eig(np.swapaxes(p, -1, -2))
+    idx = np.abs(eigvals - 1).argmin(axis=-1)
+    pi = np.take_along_axis(eigvecs, idx[..., None, None], axis=-1)[..., 0]
+    pi = np.abs(pi.real)
+    return pi / pi.sum(axis=-1, keepdims=True)
+
+
+def steady_state(p: np.ndarray, inflow: np.ndarray) -> np.ndarray:
+    """return the long-run state sizes under a constant inflow of new
+    customers, "Lost Customer" (last state) is excluded
+
+    Parameters
+    ----------
+    p : np.ndarray
+        transition matrices of shape (..., n_states, n_states)
+    inflow : np.ndarray
+        new customers per state and period of shape (..., n_states)
+
+    Returns
+    -------
+    np.ndarray
+        sizes of the segments of shape (..., n_states - 1)
+    """
+    q = p[..., :-1, :-1]
+    eye = np.eye(q.shape[-1])
+    # x = inflow (I - Q)^-1, solved as (I - Q)^T x^T = inflow^T
+    return np.linalg.solve(
+        np.swapaxes(eye - q, -1, -2),
+        np.asarray(inflow, dtype=float)[..., :-1, None]
+    )[..., 0]
+
+
+def time_to_loss(p: np.ndarray) -> np.ndarray:
+    """return the expected nr. of periods until a customer of every segment
+    is lost, "Lost Customer" (last state) is excluded
+
+    Parameters
+    ----------
+    p : np.ndarray
+        transition matrices of shape (..., n_states, n_states)
+
+    Returns
+    -------
+    np.ndarray
+        expected periods of shape (..., n_states - 1), inf for segments
+        never reaching "Lost Customer"
+    """
+    q = p[..., :-1, :-1]
+    eye = np.eye(q.shape[-1])
+    try:
+        return np.linalg.solve(eye - q, np.ones(q.shape[:-1] + (1, )))[..., 0]
+    except np.linalg.LinAlgError:
+        pass
+    # singular for chains with closed segment classes, solve one by one
+    t = np.full(q.shape[:-1], np.inf)
+    for idx in np.ndindex(q.shape[:-2]):
+        reaches = reaches_lost(p[idx])
+        sub = np.ix_(reaches, reaches)
+        t[idx][reaches] = np.linalg.solve(
+            eye[sub] - q[idx][sub], np.ones(reaches.sum())
+        )
+    return t
+
+
+def reaches_lost(p: np.ndarray) -> np.ndarray:
+    """return mask of the segments from which "Lost Customer" (last state)
+    is reachable in a single transition matrix"""
+    reaches = p[:-1, -1] > 0
+    while True:
+        reaches_next = reaches | (p[:-1, :-1][:, reaches] > 0).any(axis=1)
+        if (reaches_next == reaches).all():
+            return reaches
+        reaches = reaches_next
@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import Callable
+
+import numpy as np
+
+
+def map_partitions(
+    func: Callable[[dict], object],
+    arrays: dict,
+    bounds: list,
+    n_workers: int = None
+) -> list:
+    """apply func to row partitions of numeric arrays in worker processes,
+    the arrays are placed in shared memory instead of being pickled
+
+    Parameters
+    ----------
+    func : Callable[[dict], object]
+        top-level function taking a dict of array slices, it must not
+        return views on its input
+    arrays : dict
+        numeric arrays of equal length by name
+    bounds : list
+        (start, stop) of every partition
+    n_workers : int, optional
+        nr. of worker processes, by default nr. of cpus
+
+    Returns
+    -------
+    list
+        results of func in the order of bounds
+    """
+    handles, specs = to_shared(arrays)
+    try:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(
+                executor.map(run_partition, repeat(func), repeat(specs), bounds)
+            )
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    return results
+
+
+def run_partition(func: Callable[[dict], object], specs: dict, bounds: tuple):
+    """attach to the shared arrays and apply func to one partition"""
+    handles, arrays = from_shared(specs)
+    start, stop = bounds
+    result = func({name: arr[start:stop] for name, arr in arrays.items()})
+    del arrays
+    for shm in handles:
+        shm.close()
+    return result
+
+
+def to_shared(arrays: dict) -> tuple:
+    """copy arrays to shared memory
+
+    Parameters
+    ----------
+    arrays : dict
+        numeric arrays by name
+
+    Returns
+    -------
+    tuple
+        list: shared memory blocks, to be closed and unlinked by the caller
+        dict: name, shape, and dtype of the block of every array
+    """
+    handles, specs = [], {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        handles.append(shm)
+        specs[name] = (shm.name, arr.shape, arr.dtype.str)
+    return handles, specs
+
+
+def from_shared(specs: dict) -> tuple:
+    """attach to arrays in shared memory
+
+    Parameters
+    ----------
+    specs : dict
+        name, shape, and dtype of the block of every array
+
+    Returns
+    -------
+    tuple
+        list: shared memory blocks, to be closed by the caller
+        dict: arrays by name
+    """
+    handles, arrays = [], {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return handles, arrays
+
+
+def partition_bounds(keys: np.ndarray) -> list:
+    """return (start, stop) of every run of equal values in sorted keys"""
+    if len(keys) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    stops = np.r_[starts[1:], len(keys)]
+    return [(int(start), int(stop)) for start, stop in zip(starts, stops)]
+
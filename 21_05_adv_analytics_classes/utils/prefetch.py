@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
+
+
+def prefetch(loads: dict, max_workers: int = None) -> dict:
+    """start independent loads concurrently in a thread pool, the db
+    drivers release the gil while waiting for the server
+
+    Usage, e.g.::
+
+        futures = prefetch({
+            "survival": partial(load_survival_data, sp_params),
+            "addons": partial(demographic_addons, df_base, jamo),
+        })
+        for name, df in as_loaded(futures):
+            ...
+
+    The segment history of 20-05_customer_segments_plotly lives in a
+    top-level module utils.py as well, which is shadowed by this package.
+    Load it under another name to prefetch it together with the above,
+    e.g. from the notebooks::
+
+        import importlib.util
+
+        spec = importlib.util.spec_from_file_location(
+            "segments_utils", "../../20-05_customer_segments_plotly/utils.py"
+        )
+        segments_utils = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(segments_utils)
+
+        futures = prefetch({
+            "segments": partial(segments_utils.get_segments_data, yearmon_dict),
+            "survival": partial(load_survival_data, sp_params),
+        })
+
+    Parameters
+    ----------
+    loads : dict
+        functions without arguments returning a dataframe by name
+    max_workers : int, optional
+        nr. of threads, by default one per load
+
+    Returns
+    -------
+    dict
+        futures of the dataframes by name
+    """
+    executor = ThreadPoolExecutor(max_workers or max(len(loads), 1))
+    futures = {name: executor.submit(load) for name, load in loads.items()}
+    # threads are released as soon as the loads are done
+    executor.shutdown(wait=False)
+    return futures
+
+
+def as_loaded(futures: dict) -> Iterator[tuple]:
+    """yield name and dataframe of every load as soon as it is done, the
+    exception of a failed load is raised when it is reached
+
+    Parameters
+    ----------
+    futures : dict
+        futures of the dataframes by name as returned by prefetch
+
+    Yields
+    ------
+    tuple
+        name: str
+            name of the load
+        df: pd.DataFrame
+            result of the load
+    """
+    names = {future: name for name, future in futures.items()}
+    for future in as_completed(names):
+        yield names[future], future.result()
+
+
+def load_all(loads: dict, max_workers: int = None) -> dict:
+    """run independent loads concurrently and wait for all of them
+
+    Parameters
+    ----------
+    loads : dict
+        functions without arguments returning a dataframe by name
+    max_workers : int, optional
+        nr. of threads, by default one per load
+
+    Returns
+    -------
+    dict
+        dataframes by name in the order of loads
+    """
+    futures = prefetch(loads, max_workers)
+    frames = dict(as_loaded(futures))
+    return {name: frames[name] for name in loads}
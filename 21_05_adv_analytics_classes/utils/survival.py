@@ -1,14 +1,34 @@
-import bcag
 from bcag.sql_utils import execute_stored_procedure
+import json
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from functools import reduce
 from matplotlib import pyplot as plt
+from matplotlib.collections import PolyCollection
 import seaborn as sns
+from functools import partial
+from statistics import NormalDist
 
+from utils.cache import cached
+from utils.engines import get_engine
+from utils.parallel import map_partitions, partition_bounds
 
-def load_survival_data(sp_params: dict) -> pd.DataFrame:
+STRATA_COLS = ["group_name", "cohort", "status_full"]
+# columns used by proportion_by_status, create_df_survival and survival_state
+SURVIVAL_COLS = [
+    "konto_id", "jamo", "month_nr", "is_valid", "bearbeitet_datum",
+    "status_full", "group_name", "n_days_to_invalid"
+]
+
+
+def load_survival_data(
+    sp_params: dict,
+    columns: list = None,
+    first_month_only: bool = False,
+    chunksize: int = 100_000,
+    use_cache: bool = False
+) -> pd.DataFrame:
     """load survival data from jemas and return them as df
 
     Parameters
@@ -16,18 +36,115 @@ def load_survival_data(sp_params: dict) -> pd.DataFrame:
     sp_params : dict
         defining start and end of considered period
         containing sql string to create groups
+    columns : list, optional
+        columns to be transferred (e.g. SURVIVAL_COLS), by default all
+    first_month_only : bool, optional
+        transfer rows with month_nr == 1 only, by default False
+    chunksize : int, optional
+        nr. of rows transferred per chunk, by default 100_000
+    use_cache : bool, optional
+        reuse the result of a former call with the same parameters from the
+        parquet cache, by default False
 
     Returns
     -------
     pd.DataFrame
         df with required data
     """
-    engine = bcag.connect("jemas", "prod", "jemas_temp")
-    execute_stored_procedure(engine, "thm.sp_survival_default", sp_params)
-    df_ncas = pd.read_sql("select * from thm.survival_default", engine)
+
+    def load() -> pd.DataFrame:
+        engine = get_engine("jemas", "prod", "jemas_temp")
+        execute_stored_procedure(engine, "thm.sp_survival_default", sp_params)
+        with engine.connect() as con:
+            return read_survival_table(
+                con, columns, first_month_only, chunksize
+            )
+
+    if not use_cache:
+        return load()
+    cache_params = dict(
+        sp_params, columns=columns, first_month_only=first_month_only
+    )
+    df_ncas = cached("thm.sp_survival_default", cache_params, load)
+    return df_ncas
+
+
+def read_survival_table(
+    con,
+    columns: list = None,
+    first_month_only: bool = False,
+    chunksize: int = 100_000,
+    table: str = "thm.survival_default"
+) -> pd.DataFrame:
+    """read survival table in chunks, compacting every chunk on arrival
+
+    Parameters
+    ----------
+    con : sqlalchemy engine or dbapi connection
+        connection to the database holding the table
+    columns : list, optional
+        columns to be transferred, by default all
+    first_month_only : bool, optional
+        transfer rows with month_nr == 1 only, by default False
+    chunksize : int, optional
+        nr. of rows transferred per chunk, by default 100_000
+    table : str, optional
+        name of the table, by default "thm.survival_default"
+
+    Returns
+    -------
+    pd.DataFrame
+        df with categorical status and group, datetime bearbeitet_datum,
+        and downcasted integer columns
+    """
+    select = "*" if columns is None else ", ".join(columns)
+    query = f"select {select} from {table}"
+    if first_month_only:
+        query += " where month_nr = 1"
+    chunks = [
+        compact_chunk(df_chunk)
+        for df_chunk in pd.read_sql(query, con, chunksize=chunksize)
+    ]
+    if len(chunks) == 0:
+        return compact_chunk(pd.read_sql(query, con))
+    # align categories, otherwise concat falls back to object dtype
+    for col in ["status_full", "group_name"]:
+        if col in chunks[0].columns:
+            categories = pd.api.types.union_categoricals(
+                [df_chunk[col] for df_chunk in chunks], sort_categories=True
+            ).categories
+            for df_chunk in chunks:
+                df_chunk[col] = df_chunk[col].cat.set_categories(categories)
+    df_ncas = pd.concat(chunks, ignore_index=True)
     return df_ncas
 
 
+def compact_chunk(df_chunk: pd.DataFrame) -> pd.DataFrame:
+    """convert status and group to category, bearbeitet_datum to datetime,
+    and downcast integer columns
+
+    Parameters
+    ----------
+    df_chunk : pd.DataFrame
+        chunk of the survival table
+
+    Returns
+    -------
+    pd.DataFrame
+        compact chunk
+    """
+    for col in ["status_full", "group_name"]:
+        if col in df_chunk.columns:
+            df_chunk[col] = df_chunk[col].astype("category")
+    if "bearbeitet_datum" in df_chunk.columns:
+        df_chunk["bearbeitet_datum"] = (
+            pd.to_datetime(df_chunk["bearbeitet_datum"])
+        )
+    for col in df_chunk.select_dtypes("integer").columns:
+        df_chunk[col] = pd.to_numeric(df_chunk[col], downcast="integer")
+    return df_chunk
+
+
 def preprocess_df(df_ncas: pd.DataFrame) -> pd.DataFrame:
     """preprocess df and return clean df
 
@@ -110,36 +227,100 @@ def proportion_by_status(df_ncas: pd.DataFrame) -> tuple:
         pd.DataFrame: aggregated df
         list: distinct cohorts
     """
-    df_status = df_ncas.query("month_nr == 1").copy()
-    df_tmp = (
-        df_status.groupby(["group_name", "cohort"]
-                          )["status_full"].count().reset_index().rename(
-                              columns={"status_full": "n_accounts_tot"}
-                          )
-    )
-    df_status_agg = (
-        df_status.groupby(
-            ["group_name", "cohort"]
-        )["status_full"].value_counts().rename("n_accounts").reset_index()
-    )
-    df_status_agg = (
-        df_status_agg.merge(df_tmp, how="inner", on=[
-            "group_name", "cohort"
-        ]).eval("prop_accounts = n_accounts / n_accounts_tot")
-    )
-    df_status_agg.sort_values(
-        ["cohort", "group_name", "status_full"], inplace=True
-    )
-    df_status_agg["prop_accounts_cum"] = (
-        df_status_agg.groupby(["group_name", "cohort"]
-                              )["prop_accounts"].cumsum().shift(1).fillna(0)
-    )
-    df_status_agg.loc[df_status_agg["prop_accounts_cum"] == 1,
-                      "prop_accounts_cum"] = 0
+    is_first = df_ncas["month_nr"].to_numpy() == 1
+    code_group, groups = pd.factorize(
+        df_ncas["group_name"][is_first], sort=True
+    )
+    code_cohort, cohorts = pd.factorize(df_ncas["cohort"][is_first], sort=True)
+    status_dtype = df_ncas["status_full"].dtype
+    code_status = df_ncas["status_full"].cat.codes.to_numpy()[is_first]
+    n_groups, n_status = len(groups), len(status_dtype.categories)
+    n_strata = len(cohorts) * n_groups
+    # one count per (cohort, group, status), in the order of the output
+    code_strata = np.where(
+        (code_group >= 0) & (code_cohort >= 0),
+        code_cohort * n_groups + code_group, -1
+    )
+    is_counted = (code_strata >= 0) & (code_status >= 0)
+    n_accounts = np.bincount(
+        code_strata[is_counted] * n_status + code_status[is_counted],
+        minlength=n_strata * n_status
+    ).reshape(-1, n_status)
+    n_rows = np.bincount(code_strata[code_strata >= 0], minlength=n_strata)
+    is_present = n_rows > 0
+    n_accounts = n_accounts[is_present]
+    n_accounts_tot = n_accounts.sum(axis=1)
+    prop_accounts = n_accounts / n_accounts_tot[:, None]
+    # bottoms of the stacked bars, 0 for the first status of every group,
+    # compensated summation as in pandas' groupby cumsum
+    prop_accounts_cum = np.empty_like(prop_accounts)
+    accum = np.zeros(len(prop_accounts))
+    compensation = np.zeros(len(prop_accounts))
+    for idx in range(n_status):
+        y = prop_accounts[:, idx] - compensation
+        t = accum + y
+        compensation = t - accum - y
+        accum = t
+        prop_accounts_cum[:, idx] = accum
+    prop_accounts_cum = np.r_[0, prop_accounts_cum.ravel()[:-1]]
+    prop_accounts_cum[prop_accounts_cum == 1] = 0
+    idx_strata = np.flatnonzero(is_present)
+    df_status_agg = pd.DataFrame(
+        {
+            "group_name":
+                np.repeat(
+                    np.asarray(groups, dtype=object)[idx_strata % n_groups],
+                    n_status
+                ),
+            "cohort":
+                np.repeat(np.asarray(cohorts)[idx_strata // n_groups], n_status),
+            "status_full":
+                pd.Categorical.from_codes(
+                    np.tile(np.arange(n_status), len(idx_strata)),
+                    dtype=status_dtype
+                ),
+            "n_accounts":
+                n_accounts.ravel(),
+            "n_accounts_tot":
+                np.repeat(n_accounts_tot, n_status),
+            "prop_accounts":
+                prop_accounts.ravel(),
+            "prop_accounts_cum":
+                prop_accounts_cum,
+        }
+    )
     cohorts = df_status_agg["cohort"].unique().tolist()
     return (df_status_agg, cohorts)
 
 
+def map_sorted_partitions(
+    func, arrays: dict, code_partition: np.ndarray, n_workers: int
+) -> list:
+    """sort arrays by partition code and apply func to every partition in
+    worker processes, results are returned in the order of the codes
+
+    Parameters
+    ----------
+    func : callable
+        top-level function taking a dict of array slices
+    arrays : dict
+        numeric arrays of equal length by name
+    code_partition : np.ndarray
+        partition code of every row
+    n_workers : int
+        nr. of worker processes
+
+    Returns
+    -------
+    list
+        result of func per partition
+    """
+    order = np.argsort(code_partition, kind="stable")
+    arrays = {name: arr[order] for name, arr in arrays.items()}
+    bounds = partition_bounds(code_partition[order])
+    return map_partitions(func, arrays, bounds, n_workers)
+
+
 def plot_status_by_group(
     df_status_agg: pd.DataFrame, cohorts: list, status_colors: list, axs
 ):
@@ -155,57 +336,88 @@ def plot_status_by_group(
         colors to be used for different status
     axs : matplotlib axes object
     """
-
-    for i, ax in enumerate(axs.flat):
-        df_tmp = df_status_agg.query(f"""cohort == {cohorts[i]}""")
-        df_tmp = prop_approved(df_tmp)
-        df_tmp.sort_values(["prop_ccf"], ascending=False, inplace=True)
-        for idx, c in enumerate(df_tmp["status_full"].cat.categories):
-            color = status_colors[idx]
-            df_plt = df_tmp.query(f"""status_full == '{c}'""")
-            if idx == 0:
-                ax.bar("group_name", "prop_accounts", data=df_plt, color=color)
-            elif idx > 0:
-                ax.bar(
-                    "group_name",
-                    "prop_accounts",
-                    data=df_plt,
-                    bottom="prop_accounts_cum",
-                    color=color,
-                    edgecolor="white"
+    cube, groups, status = status_cube(df_status_agg, cohorts)
+    idx_ccf = (
+        status.get_loc("Approved CCF") if "Approved CCF" in status else None
+    )
+    for i, (ax, props) in enumerate(zip(axs.flat, cube)):
+        is_present = ~np.isnan(props).all(axis=1)
+        props = np.nan_to_num(props[is_present])
+        xlabels = groups[is_present]
+        if idx_ccf is not None:
+            order = np.argsort(-props[:, idx_ccf], kind="stable")
+            props, xlabels = props[order], xlabels[order]
+        bottoms = np.cumsum(props, axis=1) - props
+        # one collection of bars per status instead of one patch per bar
+        x = np.arange(len(xlabels))
+        for idx in range(len(status)):
+            verts = np.stack(
+                [
+                    np.column_stack([x - .4, bottoms[:, idx]]),
+                    np.column_stack([x - .4, bottoms[:, idx] + props[:, idx]]),
+                    np.column_stack([x + .4, bottoms[:, idx] + props[:, idx]]),
+                    np.column_stack([x + .4, bottoms[:, idx]]),
+                ],
+                axis=1
+            )
+            ax.add_collection(
+                PolyCollection(
+                    verts,
+                    facecolors=status_colors[idx],
+                    edgecolors="white" if idx > 0 else "none"
                 )
-        xlabels = list(df_tmp["group_name"].unique())
-        ax.set_xticks(xlabels)
+            )
+        ax.autoscale_view()
+        ax.set_ylim(bottom=0)
+        ax.set_xticks(x)
         ax.set_xticklabels(xlabels, rotation=90)
         ax.set_title(f"Cohort = {cohorts[i]}")
         if i == len(axs) - 1:
-            ax.legend(df_tmp["status_full"].cat.categories, loc="right")
+            ax.legend(status, loc="right")
     return axs
 
 
-def prop_approved(df_tmp: pd.DataFrame) -> pd.DataFrame:
-    """add a column with the percentage approved ccf
+def status_cube(df_status_agg: pd.DataFrame, cohorts: list) -> tuple:
+    """pivot aggregated df into an array with prop. accounts by cohort,
+    group, and status, combinations without accounts are nan
 
     Parameters
     ----------
-    df_tmp : pd.DataFrame
-        df with columns group_name, status_full, and prop_accounts
+    df_status_agg : pd.DataFrame
+        aggregated df
+    cohorts : list
+        list with cohorts to plot
 
     Returns
     -------
-    pd.DataFrame
-        same df with added column
+    tuple
+        np.ndarray: prop. accounts of shape (cohorts, groups, status)
+        np.ndarray: sorted group names
+        pd.Index: status categories
     """
-    df_max = (
-        df_tmp.query("status_full == 'Approved CCF'")[[
-            "group_name", "prop_accounts"
-        ]].rename(columns={"prop_accounts": "prop_ccf"})
+    groups = np.sort(df_status_agg["group_name"].unique().astype(str))
+    status = df_status_agg["status_full"].cat.categories
+    idx_cohort = pd.Index(cohorts).get_indexer(df_status_agg["cohort"])
+    idx_group = (
+        pd.Index(groups).get_indexer(df_status_agg["group_name"].astype(str))
     )
-    df_tmp = df_tmp.merge(df_max, how="inner", on="group_name")
-    return df_tmp
+    idx_status = df_status_agg["status_full"].cat.codes.to_numpy()
+    is_plotted = (idx_cohort >= 0) & (idx_status >= 0)
+    cube = np.full((len(cohorts), len(groups), len(status)), np.nan)
+    cube[idx_cohort[is_plotted], idx_group[is_plotted],
+         idx_status[is_plotted]] = (
+             df_status_agg["prop_accounts"].to_numpy()[is_plotted]
+         )
+    return cube, groups, status
 
 
-def create_df_survival(df_ncas: pd.DataFrame, n_min: int) -> pd.DataFrame:
+def create_df_survival(
+    df_ncas: pd.DataFrame,
+    n_min: int,
+    per_account: bool = False,
+    n_workers: int = None,
+    partition_by: str = "cohort"
+) -> pd.DataFrame:
     """create survival df containing entries for every day since nca for
     every group, every cohort, and every status
     remove entries for groups with fewer than n_min accounts 
@@ -216,83 +428,804 @@ def create_df_survival(df_ncas: pd.DataFrame, n_min: int) -> pd.DataFrame:
         df with validitiy per konto_id and jamo
     n_min : int
         thx of n accounts below which groups are silently dropped
+    per_account : bool, optional
+        censor every account at its own observation window (product-limit
+        estimator) instead of censoring by cohort, by default False
+    n_workers : int, optional
+        count partitions in n_workers processes (censoring by cohort only),
+        by default in this process
+    partition_by : str, optional
+        "cohort" or "group_name", by default "cohort"
 
     Returns
     -------
     pd.DataFrame
         aggregated df with one columns per group, cohort, status, and days since nca
     """
+    df_strata, df_events = create_df_survival_sparse(
+        df_ncas, n_min, per_account, n_workers, partition_by
+    )
+    df_survival_agg = densify_survival(df_strata, df_events)
+    return df_survival_agg
+
+
+def create_df_survival_sparse(
+    df_ncas: pd.DataFrame,
+    n_min: int,
+    per_account: bool = False,
+    n_workers: int = None,
+    partition_by: str = "cohort"
+) -> tuple:
+    """create sparse survival dfs containing only the days with drop-outs,
+    the survival step function is constant in between
+    remove entries for groups with fewer than n_min accounts
+
+    Parameters
+    ----------
+    df_ncas : pd.DataFrame
+        df with validitiy per konto_id and jamo
+    n_min : int
+        thx of n accounts below which groups are silently dropped
+    per_account : bool, optional
+        censor every account at its own observation window (product-limit
+        estimator) instead of censoring by cohort, by default False
+    n_workers : int, optional
+        count partitions in n_workers processes (censoring by cohort only),
+        by default in this process
+    partition_by : str, optional
+        "cohort" or "group_name", by default "cohort"
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame: one row per group, cohort, and status with n accounts
+            and nr. of days observed
+        pd.DataFrame: one row per group, cohort, status, and day with
+            drop-outs, with cumulated drop-outs and prop. survival
+    """
     df_survival = df_ncas.query("month_nr == 1 and is_valid == 1")
+    if per_account:
+        if n_workers is not None:
+            raise ValueError("n_workers requires censoring by cohort")
+        return kaplan_meier_sparse(df_survival, n_min)
+    if n_workers is None:
+        df_strata, df_counts = survival_counts(df_survival)
+    else:
+        df_strata, df_counts = survival_counts_parallel(
+            df_survival, n_workers, partition_by
+        )
+    return sparse_from_counts(df_strata, df_counts, n_min)
+
+
+def survival_counts(df_survival: pd.DataFrame) -> tuple:
+    """count accounts and drop-outs per group, cohort, status, and day
+
+    Parameters
+    ----------
+    df_survival : pd.DataFrame
+        df with one row per valid nca
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame: one row per group, cohort, and status with n accounts
+            and latest bearbeitet_datum
+        pd.DataFrame: one row per group, cohort, status, and day with
+            n drop-outs
+    """
+    df_strata = (
+        df_survival.groupby(STRATA_COLS, observed=True).agg(
+            n_accounts_tot=("konto_id", "count"),
+            max_bearbeitet_datum=("bearbeitet_datum", "max")
+        ).reset_index()
+    )
+    df_counts = (
+        df_survival.groupby(
+            STRATA_COLS + ["n_days_to_invalid"], observed=True
+        ).size().rename("n_accounts").reset_index()
+    )
+    return df_strata, df_counts
+
+
+def survival_counts_parallel(
+    df_survival: pd.DataFrame, n_workers: int, partition_by: str = "cohort"
+) -> tuple:
+    """count accounts and drop-outs as survival_counts, partitioned by
+    cohort or group in worker processes
+
+    Parameters
+    ----------
+    df_survival : pd.DataFrame
+        df with one row per valid nca
+    n_workers : int
+        nr. of worker processes
+    partition_by : str, optional
+        "cohort" or "group_name", by default "cohort"
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame: one row per group, cohort, and status with n accounts
+            and latest bearbeitet_datum
+        pd.DataFrame: one row per group, cohort, status, and day with
+            n drop-outs
+    """
+    df_survival = df_survival[df_survival["konto_id"].notna()]
+    code_group, groups = pd.factorize(df_survival["group_name"], sort=True)
+    code_cohort, cohorts = pd.factorize(df_survival["cohort"], sort=True)
+    status_dtype = df_survival["status_full"].dtype
+    code_status = df_survival["status_full"].cat.codes.to_numpy()
+    n_groups, n_status = len(groups), len(status_dtype.categories)
+    is_known = (code_group >= 0) & (code_cohort >= 0) & (code_status >= 0)
+    arrays = {
+        "code_strata":
+            ((code_cohort * n_groups + code_group) * n_status +
+             code_status)[is_known],
+        "n_days_to_invalid":
+            df_survival["n_days_to_invalid"].to_numpy(float)[is_known],
+        "bearbeitet_datum":
+            df_survival["bearbeitet_datum"].to_numpy().view("i8")[is_known],
+    }
+    code_partition = (
+        code_cohort if partition_by == "cohort" else code_group
+    )[is_known]
+    results = map_sorted_partitions(
+        count_strata, arrays, code_partition, n_workers
+    )
+    # partitions hold disjoint strata, reassembled in the order of the codes
+    code_strata, n_accounts_tot, max_date, code_counts, n_days, n_accounts = [
+        np.concatenate([result[i] for result in results]) for i in range(6)
+    ]
+
+    def decode(code: np.ndarray) -> dict:
+        return {
+            "group_name":
+                np.asarray(groups)[code // n_status % n_groups],
+            "cohort":
+                np.asarray(cohorts)[code // n_status // n_groups],
+            "status_full":
+                pd.Categorical.from_codes(code % n_status, dtype=status_dtype),
+        }
+
+    df_strata = pd.DataFrame(
+        dict(
+            decode(code_strata),
+            n_accounts_tot=n_accounts_tot,
+            max_bearbeitet_datum=max_date.view("datetime64[ns]")
+        )
+    )
+    df_counts = pd.DataFrame(
+        dict(
+            decode(code_counts),
+            n_days_to_invalid=n_days,
+            n_accounts=n_accounts
+        )
+    )
+    return df_strata, df_counts
+
+
+def count_strata(arrays: dict) -> tuple:
+    """count accounts and drop-outs per stratum code of one partition
+
+    Parameters
+    ----------
+    arrays : dict
+        code_strata, n_days_to_invalid, and bearbeitet_datum as int64
+
+    Returns
+    -------
+    tuple
+        np.ndarray: stratum codes
+        np.ndarray: n accounts per stratum
+        np.ndarray: latest bearbeitet_datum per stratum
+        np.ndarray: stratum codes of the drop-out counts
+        np.ndarray: days of the drop-out counts
+        np.ndarray: n drop-outs per stratum and day
+    """
+    code_strata = arrays["code_strata"]
+    order = np.argsort(code_strata, kind="stable")
+    code_sorted = code_strata[order]
+    is_start = np.ones(len(code_sorted), dtype=bool)
+    is_start[1:] = code_sorted[1:] != code_sorted[:-1]
+    starts = np.flatnonzero(is_start)
+    n_accounts_tot = np.diff(np.r_[starts, len(code_sorted)])
+    max_date = np.maximum.reduceat(arrays["bearbeitet_datum"][order], starts)
+    n_days = arrays["n_days_to_invalid"]
+    is_dropout = ~np.isnan(n_days)
+    code_dropout, n_days = code_strata[is_dropout], n_days[is_dropout]
+    order = np.lexsort((n_days, code_dropout))
+    code_dropout, n_days = code_dropout[order], n_days[order]
+    is_start = np.ones(len(code_dropout), dtype=bool)
+    is_start[1:] = (
+        (code_dropout[1:] != code_dropout[:-1]) | (n_days[1:] != n_days[:-1])
+    )
+    starts_counts = np.flatnonzero(is_start)
+    n_accounts = np.diff(np.r_[starts_counts, len(code_dropout)])
+    return (
+        code_sorted[starts], n_accounts_tot, max_date,
+        code_dropout[starts_counts], n_days[starts_counts], n_accounts
+    )
+
+
+def sparse_from_counts(
+    df_strata: pd.DataFrame, df_counts: pd.DataFrame, n_min: int
+) -> tuple:
+    """censor counts by cohort and derive the sparse survival dfs
+
+    Parameters
+    ----------
+    df_strata : pd.DataFrame
+        n accounts and latest bearbeitet_datum per group, cohort, and status
+    df_counts : pd.DataFrame
+        n drop-outs per group, cohort, status, and day
+    n_min : int
+        thx of n accounts below which groups are silently dropped
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame: one row per group, cohort, and status with n accounts
+            and nr. of days observed
+        pd.DataFrame: one row per group, cohort, status, and day with
+            drop-outs, with cumulated drop-outs and prop. survival
+    """
     # censoring
     max_days = (
-        datetime.now() - df_survival.groupby("cohort")["bearbeitet_datum"].max()
-    ).dt.days.reset_index().rename(columns={"bearbeitet_datum": "max_n_days"})
-    df_survival_agg = (
-        df_survival.groupby(
-            ["group_name", "cohort", "status_full"]
-        )["n_days_to_invalid"].value_counts().rename("n_accounts").reset_index()
+        datetime.now() -
+        df_strata.groupby("cohort")["max_bearbeitet_datum"].max()
+    ).dt.days.rename("max_n_days").reset_index()
+    thx_hi = int(max_days["max_n_days"].max())
+    df_strata = (
+        df_strata[STRATA_COLS + ["n_accounts_tot"]].merge(
+            max_days, how="inner", on="cohort"
+        )
     )
-    df_design = cross_vars(df_survival_agg, int(max_days["max_n_days"].max()))
-    df_survival_agg = df_design.merge(
-        df_survival_agg,
-        how="left",
-        on=["n_days_to_invalid", "group_name", "cohort", "status_full"]
+    # days are followed up from 1 to thx_hi - 1 at most
+    df_strata["n_days_observed"] = (
+        df_strata["max_n_days"].clip(upper=thx_hi - 1)
     )
-    df_survival_agg["n_accounts"].fillna(0, inplace=True)
-    df_tmp = (
-        df_survival.groupby(
-            ["group_name", "cohort", "status_full"]
-        )["konto_id"].count().rename("n_accounts_tot").reset_index()
+    df_strata = (
+        df_strata.query("n_accounts_tot > @n_min")
+        .sort_values(["cohort", "group_name", "status_full"])
+        .reset_index(drop=True)
     )
-    df_survival_agg = (
-        df_survival_agg.merge(
-            df_tmp, how="inner", on=["group_name", "cohort", "status_full"]
+    df_events = (
+        df_counts.merge(
+            df_strata[STRATA_COLS + ["n_accounts_tot", "n_days_observed"]],
+            how="inner",
+            on=STRATA_COLS
+        ).query("1 <= n_days_to_invalid <= n_days_observed")
+        .drop(columns="n_days_observed")
+        .sort_values(
+            ["cohort", "group_name", "status_full", "n_days_to_invalid"]
         )
+        .reset_index(drop=True)
     )
-    df_survival_agg = df_survival_agg.merge(max_days, how="inner", on="cohort")
-    df_survival_agg.query("n_days_to_invalid <= max_n_days", inplace=True)
-    df_survival_agg["prop_dropout"] = (
-        df_survival_agg.eval("n_accounts / n_accounts_tot")
-    )
-    df_survival_agg["n_dropout_cum"] = df_survival_agg.groupby(
-        ["group_name", "cohort", "status_full"]
-    )["n_accounts"].cumsum()
-    df_survival_agg["prop_survive"] = 1 - df_survival_agg.groupby(
-        ["group_name", "cohort", "status_full"]
-    )["prop_dropout"].cumsum()
-    df_survival_agg.query(f"n_accounts_tot > {n_min}", inplace=True)
+    df_events["n_accounts"] = df_events["n_accounts"].astype(float)
+    df_events["prop_dropout"] = (
+        df_events.eval("n_accounts / n_accounts_tot")
+    )
+    df_grouped = df_events.groupby(STRATA_COLS, observed=True, sort=False)
+    df_events["n_dropout_cum"] = df_grouped["n_accounts"].cumsum()
+    df_events["prop_survive"] = 1 - df_grouped["prop_dropout"].cumsum()
+    return df_strata, df_events
+
+
+def kaplan_meier_sparse(df_survival: pd.DataFrame, n_min: int) -> tuple:
+    """estimate survival with the product-limit estimator, every account is
+    followed up from its bearbeitet_datum until today and the nr. of accounts
+    at risk shrinks with every drop-out and censored account
+    drop-outs on the day of the nca are counted on day 1
+
+    Parameters
+    ----------
+    df_survival : pd.DataFrame
+        df with one row per valid nca
+    n_min : int
+        thx of n accounts below which groups are silently dropped
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame: one row per group, cohort, and status with n accounts
+            and nr. of days observed
+        pd.DataFrame: one row per group, cohort, status, and day with
+            drop-outs, with accounts at risk and prop. survival
+    """
+    n_days_observed = (
+        datetime.now() - df_survival["bearbeitet_datum"]
+    ).dt.days.clip(lower=1)
+    n_days_to_invalid = df_survival["n_days_to_invalid"].clip(lower=1)
+    is_dropout = n_days_to_invalid <= n_days_observed
+    df_accounts = df_survival[STRATA_COLS].assign(
+        n_days_to_invalid=(
+            n_days_to_invalid.where(is_dropout, n_days_observed).astype(int)
+        ),
+        n_accounts=is_dropout.astype(int),
+        max_n_days=n_days_observed
+    )
+    df_strata = (
+        df_accounts.groupby(STRATA_COLS, observed=True).agg(
+            n_accounts_tot=("n_accounts", "size"),
+            max_n_days=("max_n_days", "max")
+        ).reset_index()
+    )
+    df_strata["n_days_observed"] = df_strata["max_n_days"]
+    df_strata = (
+        df_strata.query("n_accounts_tot > @n_min")
+        .sort_values(["cohort", "group_name", "status_full"])
+        .reset_index(drop=True)
+    )
+    # one sorted pass: drop-outs and censored accounts leaving per day
+    df_events = (
+        df_accounts.groupby(
+            STRATA_COLS + ["n_days_to_invalid"], observed=True
+        ).agg(
+            n_accounts=("n_accounts", "sum"),
+            n_leaving=("n_accounts", "size")
+        ).reset_index().merge(
+            df_strata[STRATA_COLS + ["n_accounts_tot"]],
+            how="inner",
+            on=STRATA_COLS
+        ).sort_values(
+            ["cohort", "group_name", "status_full", "n_days_to_invalid"]
+        ).reset_index(drop=True)
+    )
+    df_grouped = df_events.groupby(STRATA_COLS, observed=True, sort=False)
+    df_events["n_at_risk"] = (
+        df_events["n_accounts_tot"] - df_grouped["n_leaving"].cumsum() +
+        df_events["n_leaving"]
+    )
+    df_events["n_accounts"] = df_events["n_accounts"].astype(float)
+    df_events["prop_dropout"] = df_events.eval("n_accounts / n_at_risk")
+    df_events["n_dropout_cum"] = df_grouped["n_accounts"].cumsum()
+    df_events["prop_survive"] = (
+        (1 - df_events["prop_dropout"]).groupby(
+            [df_events[c] for c in STRATA_COLS], observed=True, sort=False
+        ).cumprod()
+    )
+    df_events = (
+        df_events.query("n_accounts > 0").drop(columns="n_leaving")
+        .reset_index(drop=True)
+    )
+    return df_strata, df_events
+
+
+def create_df_survival_bands(
+    df_ncas: pd.DataFrame,
+    n_min: int,
+    per_account: bool = False,
+    alpha: float = .05,
+    n_boot: int = None,
+    seed: int = None,
+    n_workers: int = None
+) -> pd.DataFrame:
+    """create survival df as create_df_survival with confidence bands of
+    prop. survival in the columns prop_survive_lower and prop_survive_upper
+
+    Parameters
+    ----------
+    df_ncas : pd.DataFrame
+        df with validitiy per konto_id and jamo
+    n_min : int
+        thx of n accounts below which groups are silently dropped
+    per_account : bool, optional
+        censor every account at its own observation window, by default False
+    alpha : float, optional
+        1 - confidence level, by default .05
+    n_boot : int, optional
+        nr. of bootstrap samples, by default None for Greenwood's formula
+    seed : int, optional
+        seed of the bootstrap, by default None
+    n_workers : int, optional
+        draw bootstrap samples in n_workers processes, by default in this
+        process
+
+    Returns
+    -------
+    pd.DataFrame
+        aggregated df with one columns per group, cohort, status, and days since nca
+    """
+    df_strata, df_events = create_df_survival_sparse(
+        df_ncas, n_min, per_account
+    )
+    df_events = survival_bands(
+        df_strata, df_events, alpha, n_boot, seed, n_workers
+    )
+    df_survival_agg = densify_survival(df_strata, df_events)
     return df_survival_agg
 
 
-def cross_vars(df_survival_agg: pd.DataFrame, thx_hi: int) -> pd.DataFrame:
-    """cross required variables
-    to create design df (containing all relevant combinations)
+def survival_bands(
+    df_strata: pd.DataFrame,
+    df_events: pd.DataFrame,
+    alpha: float = .05,
+    n_boot: int = None,
+    seed: int = None,
+    n_workers: int = None
+) -> pd.DataFrame:
+    """add confidence bands of prop. survival to the sparse survival df,
+    pointwise by Greenwood's formula or by percentile bootstrap
 
     Parameters
     ----------
-    df_survival_agg : pd.DataFrame
-        df with aggregated info about survival
-    thx_hi : int
-        upper thx of nr. days followed up after nca
+    df_strata : pd.DataFrame
+        df with one row per group, cohort, and status
+    df_events : pd.DataFrame
+        df with one row per group, cohort, status, and day with drop-outs
+    alpha : float, optional
+        1 - confidence level, by default .05
+    n_boot : int, optional
+        nr. of bootstrap samples, by default None for Greenwood's formula
+    seed : int, optional
+        seed of the bootstrap, by default None
+    n_workers : int, optional
+        draw bootstrap samples in n_workers processes, by default in this
+        process
+
+    Returns
+    -------
+    pd.DataFrame
+        df_events with prop_survive_lower and prop_survive_upper
+    """
+    df_events = df_events.copy()
+    if "n_at_risk" not in df_events.columns:
+        # censoring by cohort: nobody leaves the strata but drop-outs
+        df_events["n_at_risk"] = (
+            df_events["n_accounts_tot"] - df_events["n_dropout_cum"] +
+            df_events["n_accounts"]
+        )
+    stratum = (
+        df_events[STRATA_COLS].merge(
+            df_strata[STRATA_COLS].reset_index(), how="left", on=STRATA_COLS
+        )["index"].to_numpy()
+    )
+    if n_boot is None:
+        n_at_risk = df_events["n_at_risk"].to_numpy(float)
+        n_accounts = df_events["n_accounts"].to_numpy(float)
+        term = np.divide(
+            n_accounts,
+            n_at_risk * (n_at_risk - n_accounts),
+            out=np.zeros(len(df_events)),
+            where=n_at_risk > n_accounts
+        )
+        prop_survive = df_events["prop_survive"].to_numpy()
+        std_err = prop_survive * np.sqrt(
+            pd.Series(term).groupby(stratum, sort=False).cumsum().to_numpy()
+        )
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        df_events["prop_survive_lower"] = np.clip(
+            prop_survive - z * std_err, 0, 1
+        )
+        df_events["prop_survive_upper"] = np.clip(
+            prop_survive + z * std_err, 0, 1
+        )
+        return df_events
+    arrays = {
+        "stratum": stratum,
+        "n_accounts": df_events["n_accounts"].to_numpy(np.int64),
+        "n_at_risk": df_events["n_at_risk"].to_numpy(np.int64),
+        "n_accounts_tot": df_events["n_accounts_tot"].to_numpy(np.int64),
+    }
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    bootstrap = partial(
+        bootstrap_survival, n_boot=n_boot, alpha=alpha, seed=seed
+    )
+    if n_workers is None:
+        lower, upper = bootstrap(arrays)
+    else:
+        # whole strata per worker, seeds per stratum keep results reproducible
+        bounds = partition_bounds(stratum)
+        edges = np.linspace(0, len(bounds), n_workers + 1).astype(int)
+        bounds = [
+            (bounds[lo][0], bounds[hi - 1][1])
+            for lo, hi in zip(edges[:-1], edges[1:])
+            if hi > lo
+        ]
+        results = map_partitions(bootstrap, arrays, bounds, n_workers)
+        lower = np.concatenate([result[0] for result in results])
+        upper = np.concatenate([result[1] for result in results])
+    df_events["prop_survive_lower"] = lower
+    df_events["prop_survive_upper"] = upper
+    return df_events
+
+
+def bootstrap_survival(
+    arrays: dict, n_boot: int, alpha: float, seed: int
+) -> tuple:
+    """percentile bootstrap of prop. survival, the accounts of a stratum are
+    resampled with one multinomial draw over drop-out days and censoring
+    intervals per bootstrap sample
+
+    Parameters
+    ----------
+    arrays : dict
+        stratum, n_accounts, n_at_risk, and n_accounts_tot per drop-out day
+    n_boot : int
+        nr. of bootstrap samples
+    alpha : float
+        1 - confidence level
+    seed : int
+        seed, combined with the stratum into one generator per stratum
+
+    Returns
+    -------
+    tuple
+        np.ndarray: lower band per drop-out day
+        np.ndarray: upper band per drop-out day
+    """
+    n_events = len(arrays["stratum"])
+    lower, upper = np.empty(n_events), np.empty(n_events)
+    for start, stop in partition_bounds(arrays["stratum"]):
+        n_dropout = arrays["n_accounts"][start:stop]
+        n_at_risk = arrays["n_at_risk"][start:stop]
+        n_tot = arrays["n_accounts_tot"][start]
+        # outcomes: censored before the 1st drop-out day, then alternating
+        # drop-outs on a day and censored until the next drop-out day
+        counts = np.empty(2 * len(n_dropout) + 1, dtype=np.int64)
+        counts[0] = n_tot - n_at_risk[0]
+        counts[1::2] = n_dropout
+        counts[2::2] = n_at_risk - n_dropout - np.r_[n_at_risk[1:], 0]
+        rng = np.random.default_rng([seed, int(arrays["stratum"][start])])
+        draws = rng.multinomial(n_tot, counts / counts.sum(), size=n_boot)
+        n_at_risk_boot = n_tot - np.cumsum(draws, axis=1)[:, 0:-1:2]
+        hazard = np.divide(
+            draws[:, 1::2],
+            n_at_risk_boot,
+            out=np.zeros(n_at_risk_boot.shape),
+            where=n_at_risk_boot > 0
+        )
+        prop_survive = np.cumprod(1 - hazard, axis=1)
+        lower[start:stop], upper[start:stop] = np.quantile(
+            prop_survive, [alpha / 2, 1 - alpha / 2], axis=0
+        )
+    return lower, upper
+
+
+def survival_state(df_ncas: pd.DataFrame) -> dict:
+    """collect the counts required to update survival curves month by month
+
+    Parameters
+    ----------
+    df_ncas : pd.DataFrame
+        df with validitiy per konto_id and jamo
+
+    Returns
+    -------
+    dict
+        strata: n accounts and latest bearbeitet_datum per group, cohort,
+            and status
+        counts: n drop-outs per group, cohort, status, and day
+        open: accounts without drop-out so far, which can still drop out
+        jamo: latest jamo included
+    """
+    df_survival = df_ncas.query("month_nr == 1 and is_valid == 1")
+    df_strata, df_counts = survival_counts(df_survival)
+    df_open = (
+        df_survival.loc[df_survival["n_days_to_invalid"].isna(),
+                        ["konto_id"] + STRATA_COLS].reset_index(drop=True)
+    )
+    state = {
+        "strata": df_strata,
+        "counts": df_counts,
+        "open": df_open,
+        "jamo": int(df_ncas["jamo"].max()),
+    }
+    return state
+
+
+def update_survival_state(state: dict, df_new: pd.DataFrame) -> dict:
+    """add the rows of new jamos to the survival state, only the new slice
+    is aggregated, the counts of the former state are updated
+
+    Parameters
+    ----------
+    state : dict
+        survival state as returned by survival_state
+    df_new : pd.DataFrame
+        rows of the new jamo(s) for all accounts, older jamos are ignored
+
+    Returns
+    -------
+    dict
+        updated survival state
+    """
+    df_new = df_new[df_new["jamo"] > state["jamo"]]
+    if len(df_new) == 0:
+        return state
+    # new ncas enter the strata, drop-outs of open accounts are added
+    df_first = df_new.query("month_nr == 1 and is_valid == 1")
+    df_open = state["open"]
+    is_dropout = df_new["n_days_to_invalid"].notna()
+    df_dropped = (
+        df_new.loc[is_dropout, ["konto_id", "n_days_to_invalid"]]
+        .drop_duplicates("konto_id").merge(
+            df_open, how="inner", on="konto_id"
+        )
+    )
+    df_strata_new, df_counts_new = survival_counts(df_first)
+    df_counts_new = pd.concat(
+        [
+            df_counts_new,
+            df_dropped.groupby(
+                STRATA_COLS + ["n_days_to_invalid"], observed=True
+            ).size().rename("n_accounts").reset_index()
+        ]
+    )
+    status_dtype = state_status_dtype(state, df_new)
+    df_strata = (
+        pd.concat([state["strata"], df_strata_new]).astype(
+            {"status_full": status_dtype}
+        ).groupby(STRATA_COLS, observed=True).agg(
+            n_accounts_tot=("n_accounts_tot", "sum"),
+            max_bearbeitet_datum=("max_bearbeitet_datum", "max")
+        ).reset_index()
+    )
+    df_counts = (
+        pd.concat([state["counts"], df_counts_new]).astype(
+            {"status_full": status_dtype}
+        ).groupby(STRATA_COLS + ["n_days_to_invalid"],
+                  observed=True)["n_accounts"].sum().reset_index()
+    )
+    df_open = pd.concat(
+        [
+            df_open[~df_open["konto_id"].isin(df_dropped["konto_id"])],
+            df_first.loc[df_first["n_days_to_invalid"].isna(),
+                         ["konto_id"] + STRATA_COLS]
+        ],
+        ignore_index=True
+    ).astype({"status_full": status_dtype})
+    state = {
+        "strata": df_strata,
+        "counts": df_counts,
+        "open": df_open,
+        "jamo": int(df_new["jamo"].max()),
+    }
+    return state
+
+
+def state_status_dtype(
+    state: dict, df_new: pd.DataFrame
+) -> pd.api.types.CategoricalDtype:
+    """return ordered status dtype of the state extended by new status"""
+    categories = list(state["strata"]["status_full"].cat.categories)
+    categories += [
+        s for s in df_new["status_full"].dropna().unique()
+        if s not in categories
+    ]
+    return pd.api.types.CategoricalDtype(categories, ordered=True)
+
+
+def create_df_survival_from_state(state: dict, n_min: int) -> pd.DataFrame:
+    """create survival df from survival state, censored by cohort as in
+    create_df_survival
+
+    Parameters
+    ----------
+    state : dict
+        survival state as returned by survival_state
+    n_min : int
+        thx of n accounts below which groups are silently dropped
+
+    Returns
+    -------
+    pd.DataFrame
+        aggregated df with one columns per group, cohort, status, and days since nca
+    """
+    df_strata, df_events = sparse_from_counts(
+        state["strata"], state["counts"], n_min
+    )
+    df_survival_agg = densify_survival(df_strata, df_events)
+    return df_survival_agg
+
+
+def save_survival_state(state: dict, path: str) -> None:
+    """write survival state to a directory of parquet files
+
+    Parameters
+    ----------
+    state : dict
+        survival state as returned by survival_state
+    path : str
+        directory to write to
+    """
+    os.makedirs(path, exist_ok=True)
+    for key in ["strata", "counts", "open"]:
+        state[key].to_parquet(os.path.join(path, f"{key}.parquet"))
+    with open(os.path.join(path, "jamo.json"), "w") as f:
+        json.dump({"jamo": state["jamo"]}, f)
+
+
+def load_survival_state(path: str) -> dict:
+    """read survival state written by save_survival_state
+
+    Parameters
+    ----------
+    path : str
+        directory to read from
+
+    Returns
+    -------
+    dict
+        survival state
+    """
+    state = {
+        key: pd.read_parquet(os.path.join(path, f"{key}.parquet"))
+        for key in ["strata", "counts", "open"]
+    }
+    with open(os.path.join(path, "jamo.json"), "r") as f:
+        state["jamo"] = json.load(f)["jamo"]
+    return state
+
+
+def densify_survival(
+    df_strata: pd.DataFrame, df_events: pd.DataFrame
+) -> pd.DataFrame:
+    """expand sparse survival dfs to one row per group, cohort, status, and
+    day since nca by carrying the step function forward
+
+    Parameters
+    ----------
+    df_strata : pd.DataFrame
+        df with one row per group, cohort, and status
+    df_events : pd.DataFrame
+        df with one row per group, cohort, status, and day with drop-outs
 
     Returns
     -------
     pd.DataFrame
-        design df
+        aggregated df with one columns per group, cohort, status, and days since nca
     """
-    df_days = pd.DataFrame({"n_days_to_invalid": range(1, thx_hi)})
-    df_groups = pd.DataFrame(
-        {"group_name": df_survival_agg["group_name"].unique()}
+    n_days = df_strata["n_days_observed"].clip(lower=0).to_numpy()
+    starts = np.concatenate([[0], np.cumsum(n_days)[:-1]]).astype(int)
+    stratum = np.repeat(np.arange(len(df_strata)), n_days)
+    df_survival_agg = (
+        df_strata.iloc[stratum].drop(columns="n_days_observed")
+        .reset_index(drop=True)
+    )
+    df_survival_agg.insert(
+        2, "n_days_to_invalid", np.arange(len(stratum)) - starts[stratum] + 1
+    )
+    # position of every event within the dense frame
+    event_stratum = (
+        df_events[STRATA_COLS].merge(
+            df_strata[STRATA_COLS].reset_index(), how="left", on=STRATA_COLS
+        )["index"].to_numpy(int)
     )
-    df_cohorts = pd.DataFrame({"cohort": df_survival_agg["cohort"].unique()})
-    df_status_full = pd.DataFrame(
-        {"status_full": df_survival_agg["status_full"].cat.categories}
+    pos = (
+        starts[event_stratum] + df_events["n_days_to_invalid"].to_numpy(int) -
+        1
     )
-    df_design = reduce(
-        lambda x, y: pd.merge(x, y, how="cross"),
-        [df_groups, df_cohorts, df_days, df_status_full]
+    n_accounts = np.zeros(len(stratum))
+    n_accounts[pos] = df_events["n_accounts"].to_numpy()
+    prop_dropout = np.zeros(len(stratum))
+    prop_dropout[pos] = df_events["prop_dropout"].to_numpy()
+    last = np.full(len(stratum), -1)
+    last[pos] = np.arange(len(pos))
+    last = np.maximum.accumulate(last)
+    is_observed = last >= 0
+    # carry values forward within a stratum only
+    is_observed[is_observed] = (
+        event_stratum[last[is_observed]] == stratum[is_observed]
     )
-    return df_design
+
+    df_survival_agg.insert(4, "n_accounts", n_accounts)
+    df_survival_agg["prop_dropout"] = prop_dropout
+    # last == -1 (no event so far) picks the appended value before any event,
+    # which also covers strata without any drop-out at all
+    df_survival_agg["n_dropout_cum"] = np.where(
+        is_observed, np.append(df_events["n_dropout_cum"], 0.0)[last], 0.0
+    )
+    for col in ["prop_survive", "prop_survive_lower", "prop_survive_upper"]:
+        if col in df_events.columns:
+            df_survival_agg[col] = np.where(
+                is_observed, np.append(df_events[col], 1.0)[last], 1.0
+            )
+    df_survival_agg[["group_name", "status_full"]] = (
+        df_survival_agg[["group_name", "status_full"]].astype(object)
+    )
+    return df_survival_agg
 
 
 import qgrid
@@ -337,13 +1270,19 @@ def survival_overview(df_survival_agg: pd.DataFrame):
     return qgrid_widget
 
 
-def plot_survival(df_survival_agg: pd.DataFrame) -> plt.axes:
-    """plot survival curves by cohort, group, and status
+def plot_survival(
+    df_survival_agg: pd.DataFrame, steps: bool = False
+) -> plt.axes:
+    """plot survival curves by cohort, group, and status, with confidence
+    bands if the df contains prop_survive_lower and prop_survive_upper
 
     Parameters
     ----------
     df_survival_agg : pd.DataFrame
         df grouped by cohort, group, status and n days since nca with prop. valid as column
+    steps : bool, optional
+        collapse curves to their change points and draw them as step
+        functions without seaborn's estimator, by default False
 
     Returns
     -------
@@ -351,12 +1290,28 @@ def plot_survival(df_survival_agg: pd.DataFrame) -> plt.axes:
         faceted plot
     """
     with sns.axes_style("white") as s:
+        max_n_days = df_survival_agg["max_n_days"].max()
+        if steps:
+            df_survival_agg = survival_change_points(df_survival_agg)
         df_survival_agg["Group"] = df_survival_agg["group_name"]
         g = sns.FacetGrid(
             df_survival_agg, row="status_full", col="cohort", hue="Group"
         )
-        g.map(sns.lineplot, "n_days_to_invalid", "prop_survive")
-        n_yrs = int(np.floor(df_survival_agg["max_n_days"].max() / 365))
+        if "prop_survive_lower" in df_survival_agg.columns:
+            g.map(
+                plt.fill_between,
+                "n_days_to_invalid",
+                "prop_survive_lower",
+                "prop_survive_upper",
+                alpha=.2,
+                linewidth=0,
+                step="post" if steps else None
+            )
+        if steps:
+            g.map(plt.step, "n_days_to_invalid", "prop_survive", where="post")
+        else:
+            g.map(sns.lineplot, "n_days_to_invalid", "prop_survive")
+        n_yrs = int(np.floor(max_n_days / 365))
         for yr in range(n_yrs):
             for ax in g.axes_dict.values():
                 ax.axvline(
@@ -378,4 +1333,32 @@ def plot_survival(df_survival_agg: pd.DataFrame) -> plt.axes:
         g.add_legend()
         plt.ylim(0, 1)
         _ = g.set_axis_labels("Days passed since NCA", "Proportion Survival")
-    return g
\ No newline at end of file
+    return g
+
+
+def survival_change_points(df_survival_agg: pd.DataFrame) -> pd.DataFrame:
+    """reduce survival df to the first and last day of every group, cohort,
+    and status and the days on which prop. survival changes
+
+    Parameters
+    ----------
+    df_survival_agg : pd.DataFrame
+        df grouped by cohort, group, status and n days since nca
+
+    Returns
+    -------
+    pd.DataFrame
+        df with the rows required to draw the survival step functions
+    """
+    df_survival_agg = df_survival_agg.sort_values(
+        ["cohort", "group_name", "status_full", "n_days_to_invalid"]
+    )
+    stratum = (
+        df_survival_agg.groupby(STRATA_COLS, observed=True,
+                                sort=False).ngroup().to_numpy()
+    )
+    prop_survive = df_survival_agg["prop_survive"].to_numpy()
+    is_first = np.r_[True, stratum[1:] != stratum[:-1]]
+    is_last = np.r_[is_first[1:], True]
+    is_change = np.r_[True, prop_survive[1:] != prop_survive[:-1]]
+    return df_survival_agg[is_first | is_last | is_change].copy()
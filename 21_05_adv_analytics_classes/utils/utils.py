@@ -2,11 +2,13 @@ import numpy as np
 import pandas as pd
 import plotly.io as pio
 import plotly.graph_objects as go
-import bcag
 from bcag.sql_utils import execute_stored_procedure
 import seaborn as sns
 from matplotlib.colors import ListedColormap
 
+from utils.cache import cached
+from utils.engines import get_engine
+
 
 def counts(
     df: pd.DataFrame, g_var: str, t_var: str, t_val: list, d_var: str
@@ -31,26 +33,150 @@ def counts(
     pd.DataFrame
         aggregated dataframe
     """
-    df_tmp = df.pivot(index=g_var, columns=t_var, values=d_var).fillna(
-        value={
-            t_val[0]: "New Customer",
-            t_val[1]: "Lost Customer"
+    codes, labels = period_codes(df, g_var, t_var, t_val[:2], d_var)
+    code_new = labels.index("New Customer")
+    code_lost = labels.index("Lost Customer")
+    source = np.where(codes[:, 0] < 0, code_new, codes[:, 0])
+    target = np.where(codes[:, 1] < 0, code_lost, codes[:, 1])
+    n_labels = len(labels)
+    n_accounts = np.bincount(
+        source * n_labels + target, minlength=n_labels * n_labels
+    ).reshape(n_labels, n_labels)
+    df_base_agg = transition_frame(n_accounts, labels)
+    cols_alluvial = ["source", "target", "n_accounts"]
+    df_base_agg_alluvial = df_base_agg[cols_alluvial].copy()
+    return df_base_agg, df_base_agg_alluvial
+
+
+def transitions(
+    df: pd.DataFrame, g_var: str, t_var: str, t_val: list, d_var: str
+) -> tuple:
+    """count nobs grouped on source and target for all consecutive
+    periods in t_val in one pass
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe in long format
+    g_var : str
+        entity
+    t_var : str
+        time variable
+    t_val : list
+        labels of time variable in chronological order, at least two
+    d_var : str
+        dependent variable to be analyzed
+
+    Returns
+    -------
+    tuple
+        n_accounts: np.ndarray
+            counts of shape (n_periods - 1, n_labels, n_labels), indexed
+            by period of the source, label of source and label of target
+        labels: list
+            sorted labels incl. "New Customer" and "Lost Customer"
+        l_df_base_agg: list
+            aggregated dataframe as returned by counts for every pair of
+            consecutive periods, i.e. entities of df missing in both periods
+            are counted from "New Customer" to "Lost Customer" as well
+    """
+    if len(t_val) < 2:
+        raise ValueError("t_val must contain at least two periods")
+    codes, labels = period_codes(df, g_var, t_var, t_val, d_var)
+    n_steps, n_labels = len(t_val) - 1, len(labels)
+    source, target = codes[:, :-1], codes[:, 1:]
+    source = np.where(source < 0, labels.index("New Customer"), source)
+    target = np.where(target < 0, labels.index("Lost Customer"), target)
+    step = np.broadcast_to(np.arange(n_steps), source.shape)
+    n_accounts = np.bincount(
+        ((step * n_labels + source) * n_labels + target).ravel(),
+        minlength=n_steps * n_labels * n_labels
+    ).reshape(n_steps, n_labels, n_labels)
+    l_df_base_agg = [transition_frame(n, labels) for n in n_accounts]
+    return n_accounts, labels, l_df_base_agg
+
+
+def period_codes(
+    df: pd.DataFrame, g_var: str, t_var: str, t_val: list, d_var: str
+) -> tuple:
+    """encode label of every entity in every period
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe in long format
+    g_var : str
+        entity
+    t_var : str
+        time variable
+    t_val : list
+        labels of time variable
+    d_var : str
+        dependent variable to be analyzed
+
+    Returns
+    -------
+    tuple
+        codes: np.ndarray
+            codes of shape (n_entities, n_periods) into labels, -1 if the
+            entity is missing in a period
+        labels: list
+            sorted labels incl. "New Customer" and "Lost Customer"
+    """
+    code_g, _ = pd.factorize(df[g_var])
+    code_d, labels = pd.factorize(df[d_var])
+    code_t = pd.Index(t_val).get_indexer(df[t_var])
+    labels = list(labels)
+    for label in ["New Customer", "Lost Customer"]:
+        if label not in labels:
+            labels.append(label)
+    # sort labels as groupby does and recode accordingly
+    order = np.argsort(np.array(labels, dtype=object), kind="stable")
+    rank = np.empty(len(labels), dtype=np.int64)
+    rank[order] = np.arange(len(labels))
+    code_d = np.where(code_d < 0, -1, rank[code_d])
+    is_period = (code_t >= 0) & (code_g >= 0)
+    code_cell = code_g[is_period] * len(t_val) + code_t[is_period]
+    if np.bincount(code_cell).max(initial=0) > 1:
+        raise ValueError("Index contains duplicate entries, cannot reshape")
+    # scatter into an entity x period matrix, i.e. an outer join on entity
+    codes = np.full((code_g.max(initial=-1) + 1, len(t_val)), -1)
+    codes[code_g[is_period], code_t[is_period]] = code_d[is_period]
+    return codes, [labels[i] for i in order]
+
+
+def transition_frame(n_accounts: np.ndarray, labels: list) -> pd.DataFrame:
+    """turn a source x target count matrix into the aggregated dataframe
+    returned by counts
+
+    Parameters
+    ----------
+    n_accounts : np.ndarray
+        counts of shape (n_labels, n_labels), labels in sorted order
+    labels : list
+        sorted labels
+
+    Returns
+    -------
+    pd.DataFrame
+        aggregated dataframe
+    """
+    labels = np.array(labels, dtype=object)
+    idx_source, idx_target = np.nonzero(n_accounts)
+    df_base_agg = pd.DataFrame(
+        {
+            "source": labels[idx_source],
+            "target": labels[idx_target],
+            "n_accounts": n_accounts[idx_source, idx_target],
+            "n_total_target": n_accounts.sum(axis=0)[idx_target],
+            "n_total_source": n_accounts.sum(axis=1)[idx_source],
         }
-    ).groupby([t_val[0],
-               t_val[1]])[t_val[1]].count().rename("n_accounts").reset_index()
-    df_tmp = df_tmp.rename(columns={t_val[0]: "source", t_val[1]: "target"})
+    )
     df_base_agg = (
-        df_tmp.assign(
-            n_total_target=df_tmp.groupby("target"
-                                          )["n_accounts"].transform("sum"),
-            n_total_source=df_tmp.groupby("source")
-            ["n_accounts"].transform("sum")
-        ).eval("prop_accounts_target = n_accounts / n_total_target").
+        df_base_agg.eval("prop_accounts_target = n_accounts / n_total_target").
         eval("prop_accounts_source = n_accounts / n_total_source").round(6)
     )
-    cols_alluvial = ["source", "target", "n_accounts"]
-    df_base_agg_alluvial = df_base_agg[cols_alluvial].copy()
-    return df_base_agg, df_base_agg_alluvial
+    return df_base_agg
 
 
 def to_treemap(
@@ -157,12 +283,10 @@ def to_alluvial(df: pd.DataFrame, t_val: list, direction: str) -> tuple:
         df: pd.DataFrame
             dataframe required for labels
     """
-    l_df_lookup, l_dtypes = unique_labels(df)
+    _, l_dtypes = unique_labels(df)
     df["source"] = df["source"].astype(l_dtypes[0])
     df["target"] = df["target"].astype(l_dtypes[1])
-    df_alluvial = alluvial_info(df, l_df_lookup)
-    df_colors = alluvial_colors(df_alluvial, direction)
-    df_alluvial = plotly_labels(df_alluvial, df_colors, direction)
+    df_alluvial = pd.DataFrame(alluvial_links(df, direction))
     return df_alluvial, df
 
 
@@ -216,118 +340,209 @@ def unique_labels(df: pd.DataFrame) -> tuple:
     return l_df_lookup, l_dtypes
 
 
-def alluvial_info(df: pd.DataFrame, l_df_lookup: list) -> pd.DataFrame:
-    """aggregate df returning info required for alluvial plot
+def alluvial_links(df: pd.DataFrame, direction: str) -> dict:
+    """derive the links of the alluvial plot from the categorical codes of
+    source and target, node indices are the codes of the source and the
+    codes of the target after the source nodes
 
     Parameters
     ----------
     df : pd.DataFrame
-        raw dataframe containing all data
-    l_df_lookup : list
-        list with lookup dataframes for source and target
+        dataframe with source and target as categories and n_accounts
+    direction : str
+        direction, in which analysis should be shown
 
     Returns
     -------
-    pd.DataFrame
-        dataframe with all information required for alluvial plot
+    dict
+        value, source, target, color and label of every link as passed to
+        go.Sankey, sorted by source and target
     """
-    df_alluvial = (
-        df.merge(
-            l_df_lookup[0], how="inner", left_on="source", right_on="labels"
-        ).drop(columns=["source", "labels"]
-               ).rename(columns={
-                   "values": "source"
-               }).merge(
-                   l_df_lookup[1],
-                   how="inner",
-                   left_on="target",
-                   right_on="labels"
-               ).drop(columns=["target", "labels"]
-                      ).rename(columns={"values": "target"})
-    )
-    df_alluvial["target"] = df_alluvial["target"] + df_alluvial["source"].max(
-    ) + 1
-    (df_alluvial.rename(columns={"n_accounts": "value"}, inplace=True))
-    return df_alluvial
+    code_source = df["source"].cat.codes.to_numpy().astype(np.int64)
+    code_target = df["target"].cat.codes.to_numpy().astype(np.int64)
+    is_valid = (code_source >= 0) & (code_target >= 0)
+    order = np.lexsort((code_target[is_valid], code_source[is_valid]))
+    source = code_source[is_valid][order]
+    target = code_target[is_valid][order]
+    value = df["n_accounts"].to_numpy()[is_valid][order]
+    if len(source):
+        target = target + source.max() + 1
+    code_direction = source if direction == "source" else target
+    # colors in the order of the nodes, repeated if there are more nodes
+    colors = np.array(pio.templates["plotly"]["layout"]["colorway"])
+    _, idx_direction = np.unique(code_direction, return_inverse=True)
+    color = colors[idx_direction % len(colors)]
+    n_direction = np.bincount(idx_direction, weights=value)
+    label = np.round(value / n_direction[idx_direction], 2)
+    if direction == "target":
+        # links grouped by target in order of appearance as a merge does
+        _, idx_first = np.unique(idx_direction, return_index=True)
+        rank = np.argsort(np.argsort(idx_first, kind="stable"))
+        regroup = np.argsort(rank[idx_direction], kind="stable")
+        value, source, target = value[regroup], source[regroup], target[regroup]
+        color, label = color[regroup], label[regroup]
+    return {
+        "value": value,
+        "source": source,
+        "target": target,
+        "color": color,
+        "label": label
+    }
 
 
-def alluvial_colors(df: pd.DataFrame, direction: str) -> pd.DataFrame:
-    """create a df containing required discrete colors
+def alluvial(
+    df_base_agg_alluvial: pd.DataFrame, df_alluvial: pd.DataFrame
+) -> go.Figure:
+    """plot alluvial from source to target in reading direction
 
     Parameters
     ----------
-    df : pd.DataFrame
-        dataframe, which is going to be used for alluvial plot
-    direction : str
-        direction, in which analysis should be shown
+    df_base_agg_alluvial : pd.DataFrame
+        dataframe with labels as categories
+    df_alluvial : pd.DataFrame
+        main dataframe for plot
 
     Returns
     -------
-    pd.DataFrame
-        dataframe mapping values to colors
+    go.Figure
+        plotly.graph_object
     """
-    plotly_template = pio.templates["plotly"]
-    colors = plotly_template["layout"]["colorway"]
-    vals = sorted(df[direction].unique())
-    df_colors = pd.DataFrame({direction: vals, "color": colors[0:len(vals)]})
-    return df_colors
+    cat_source = [
+        c for c in df_base_agg_alluvial["source"].cat.categories
+        if c != "Lost Customer"
+    ]
+    cat_target = [
+        c for c in df_base_agg_alluvial["target"].cat.categories
+        if c != "New Customer"
+    ]
+    f = go.Figure(
+        data=[
+            go.Sankey(
+                node=dict(
+                    pad=15,
+                    thickness=20,
+                    line=dict(color="black", width=0.5),
+                    label=cat_source + cat_target,
+                    color=alluvial_node_colors(
+                        df_alluvial, len(cat_source) + len(cat_target)
+                    )
+                ),
+                link=df_alluvial.to_dict("list")
+            )
+        ],
+        layout={
+            "height": 800,
+            "width": 800
+        }
+    )
+    f.update_layout(title_text="Development Path", font_size=10)
+    return f
 
 
-def plotly_labels(
-    df_alluvial: pd.DataFrame, df_colors: pd.DataFrame, direction: str
-) -> pd.DataFrame:
-    """add labels to be shown in the plot
+def alluvial_node_colors(df_alluvial: pd.DataFrame, n_nodes: int) -> list:
+    """derive one color per node from the node codes of the links, the
+    nodes of source and target are colored by their rank, as the links of
+    the analysed direction in alluvial_links
 
     Parameters
     ----------
     df_alluvial : pd.DataFrame
-        dataframe in format required for alluvial plot
-    df_colors : pd.DataFrame
-        dataframe mapping colors to values
+        links as returned by to_alluvial
+    n_nodes : int
+        nr. of node labels
+
+    Returns
+    -------
+    list
+        colors of the nodes, repeated if there are more nodes than colors,
+        nodes without links are grey
+    """
+    colors = np.array(pio.templates["plotly"]["layout"]["colorway"])
+    node_color = np.full(n_nodes, "lightgrey", dtype=object)
+    for col in ["source", "target"]:
+        codes = np.unique(df_alluvial[col].to_numpy())
+        node_color[codes] = colors[np.arange(len(codes)) % len(colors)]
+    return list(node_color)
+
+
+def to_alluvial_chain(
+    l_df_base_agg: list, labels: list, direction: str
+) -> tuple:
+    """bring the aggregated dataframes of consecutive periods into the
+    format of a multi-stage alluvial, nodes are numbered per period
+
+    Parameters
+    ----------
+    l_df_base_agg : list
+        aggregated dataframes as returned by transitions
+    labels : list
+        sorted labels as returned by transitions
     direction : str
         direction, in which analysis should be shown
 
     Returns
     -------
-    pd.DataFrame
-        dataframe with all labels formatted with regards to plotly object
+    tuple
+        df_alluvial: pd.DataFrame
+            links of all periods required to plot alluvial
+        df_nodes: pd.DataFrame
+            label and color of the nodes of all periods
     """
-    df_alluvial = df_alluvial.sort_values(["source", "target"])
-    df_alluvial = (df_alluvial.merge(df_colors, how="inner", on=direction))
-    df_alluvial = df_alluvial.assign(
-        label=np.round(
-            df_alluvial["value"] /
-            df_alluvial.groupby(direction)["value"].transform("sum"), 2
+    n_labels = len(labels)
+    lookup = pd.Series(np.arange(n_labels), index=labels)
+    colorway = pio.templates["plotly"]["layout"]["colorway"]
+    colors = np.array(
+        [colorway[i % len(colorway)] for i in range(n_labels)], dtype=object
+    )
+    l_df_alluvial = []
+    for step, df in enumerate(l_df_base_agg):
+        code_source = df["source"].map(lookup).to_numpy()
+        code_target = df["target"].map(lookup).to_numpy()
+        code_direction = code_source if direction == "source" else code_target
+        l_df_alluvial.append(
+            pd.DataFrame(
+                {
+                    "source": step * n_labels + code_source,
+                    "target": (step + 1) * n_labels + code_target,
+                    "value": df["n_accounts"].to_numpy(),
+                    "color": colors[code_direction],
+                    "label": np.round(
+                        df[f"prop_accounts_{direction}"].to_numpy(), 2
+                    )
+                }
+            )
         )
+    df_alluvial = pd.concat(l_df_alluvial, ignore_index=True)
+    n_periods = len(l_df_base_agg) + 1
+    df_nodes = pd.DataFrame(
+        {
+            "label": np.tile(np.array(labels, dtype=object), n_periods),
+            "color": np.tile(colors, n_periods)
+        }
     )
-    return df_alluvial
+    return df_alluvial, df_nodes
 
 
-def alluvial(
-    df_base_agg_alluvial: pd.DataFrame, df_alluvial: pd.DataFrame
+def alluvial_chain(
+    df_nodes: pd.DataFrame, df_alluvial: pd.DataFrame, t_val: list
 ) -> go.Figure:
-    """plot alluvial from source to target in reading direction
+    """plot multi-stage alluvial over consecutive periods in reading
+    direction
 
     Parameters
     ----------
-    df_base_agg_alluvial : pd.DataFrame
-        dataframe with labels as categories
+    df_nodes : pd.DataFrame
+        label and color of the nodes of all periods
     df_alluvial : pd.DataFrame
-        main dataframe for plot
+        links of all periods
+    t_val : list
+        labels of time variable
 
     Returns
     -------
     go.Figure
         plotly.graph_object
     """
-    cat_source = [
-        c for c in df_base_agg_alluvial["source"].cat.categories
-        if c != "Lost Customer"
-    ]
-    cat_target = [
-        c for c in df_base_agg_alluvial["target"].cat.categories
-        if c != "New Customer"
-    ]
     f = go.Figure(
         data=[
             go.Sankey(
@@ -335,18 +550,21 @@ def alluvial(
                     pad=15,
                     thickness=20,
                     line=dict(color="black", width=0.5),
-                    label=cat_source + cat_target,
-                    color=list(np.tile(df_alluvial["color"].unique(), 2))
+                    label=list(df_nodes["label"]),
+                    color=list(df_nodes["color"])
                 ),
                 link=df_alluvial.to_dict("list")
             )
         ],
         layout={
             "height": 800,
-            "width": 800
+            "width": max(800, 300 * len(t_val))
         }
     )
-    f.update_layout(title_text="Development Path", font_size=10)
+    f.update_layout(
+        title_text=f"Development Path {t_val[0]} to {t_val[-1]}",
+        font_size=10
+    )
     return f
 
 
@@ -388,10 +606,6 @@ def sort_transitions(df: pd.DataFrame, is_transition: bool) -> None:
         title = "Transitions of Categories"
     else:
         title = "Stability of Categories"
-    if is_transition:
-        sign = "!"
-    else:
-        sign = "="
     df_transition = (
         df[[
             "source", "target", "n_accounts", "n_total_source",
@@ -401,7 +615,7 @@ def sort_transitions(df: pd.DataFrame, is_transition: bool) -> None:
     df_transition["prop_accounts_source"] = df_transition["prop_accounts_source"
                                                           ].round(4)
     df_out = (
-        df_transition.query(f"source {sign}= target").sort_values(
+        df_transition.query("(source != target) == @is_transition").sort_values(
             "prop_accounts_source", ascending=False
         ).reset_index(drop=True
                       ).rename(columns=columns
@@ -421,13 +635,20 @@ def sort_transitions(df: pd.DataFrame, is_transition: bool) -> None:
     return df_out
 
 
-def demographic_addons(df: pd.DataFrame, jamo: int) -> pd.DataFrame:
+def demographic_addons(
+    df: pd.DataFrame, jamo: int, use_cache: bool = False
+) -> pd.DataFrame:
     """read addon data from jemas and join with df
 
     Parameters
     ----------
     df : pd.DataFrame
         data frame with konto_lauf_id as column
+    jamo : int
+        jamo to query data from
+    use_cache : bool, optional
+        reuse the addons of a former call with the same jamo from the
+        parquet cache, by default False
 
     Returns
     -------
@@ -435,13 +656,21 @@ def demographic_addons(df: pd.DataFrame, jamo: int) -> pd.DataFrame:
         joined df
     """
     sp_args = dict({"jamo_last": jamo})
-    engine_jemas = bcag.connect("jemas", "prod", "jemas_temp")
-    execute_stored_procedure(
-        engine_jemas, "thm.addons_purchase_interest", sp_args
-    )
-    df_addons = pd.read_sql(
-        "select * from jemas_temp.thm.purchase_interest_addons", engine_jemas
-    )
+
+    def load() -> pd.DataFrame:
+        engine_jemas = get_engine("jemas", "prod", "jemas_temp")
+        execute_stored_procedure(
+            engine_jemas, "thm.addons_purchase_interest", sp_args
+        )
+        with engine_jemas.connect() as con:
+            return pd.read_sql(
+                "select * from jemas_temp.thm.purchase_interest_addons", con
+            )
+
+    if use_cache:
+        df_addons = cached("thm.addons_purchase_interest", sp_args, load)
+    else:
+        df_addons = load()
     df_rich = df.merge(df_addons, how="inner", on="konto_lauf_id")
     return df_rich
 
@@ -465,7 +694,7 @@ def prepare_demographic_addons(
     tuple
         df with added info and aggregated df to plot heatmap
     """
-    df_rich = demographic_addons(df_base.query(f"""jamo == {jamo}"""), jamo)
+    df_rich = demographic_addons(df_base.query("jamo == @jamo"), jamo)
     df_rich.drop(columns=["konto_id", "jamo"], inplace=True)
     df_rich["prop_w"] = df_rich["anredecode"] == "W"
     df_rich["prop_cc"] = df_rich["cardprofile"] == "CC"